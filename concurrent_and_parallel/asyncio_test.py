@@ -1,11 +1,10 @@
 import os
-import re
 import sys
 import json
-import random
+import time
 import asyncio
+import functools
 from asyncio import Queue
-from asyncio.windows_events import ProactorEventLoop
 import logging
 import concurrent
 from logging.handlers import RotatingFileHandler
@@ -13,7 +12,30 @@ from logging.handlers import RotatingFileHandler
 import aiohttp
 import async_timeout
 import redis
-from lxml import etree
+from redis import asyncio as aioredis
+
+try:
+    from .task_queue import RedisTaskQueue
+    from .bloom_filter import RedisBloomFilter
+    from .page_parser import ParseStage, parse_detail_task, parse_download_task
+    from .rate_limit import HostThrottle
+    from .proxy_pool import ProxyPool
+    from .image_writer import ImageWriter
+    from .retry_queue import RetryScheduler
+    from . import event_loops
+    from .metrics import MetricsRegistry, SIZE_BUCKETS
+    from .fingerprint import FingerprintStore, UNCHANGED
+except ImportError:
+    from task_queue import RedisTaskQueue
+    from bloom_filter import RedisBloomFilter
+    from page_parser import ParseStage, parse_detail_task, parse_download_task
+    from rate_limit import HostThrottle
+    from proxy_pool import ProxyPool
+    from image_writer import ImageWriter
+    from retry_queue import RetryScheduler
+    import event_loops
+    from metrics import MetricsRegistry, SIZE_BUCKETS
+    from fingerprint import FingerprintStore, UNCHANGED
 
 # logging.getLogger('asyncio').setLevel(logging.DEBUG)
 
@@ -34,7 +56,9 @@ def setup_log(level, file_path, max_bytes=20 * 1024 * 1024, backup_count=5):
 
 
 class Crawler(object):
-    def __init__(self, max_tries=4, max_tasks=10, *, loop=None):
+    def __init__(self, max_tries=4, max_tasks=10, batch_size=100, seen_filter=None, parse_workers=None,
+                 parse_queue_size=100, host_rate=10, host_max_concurrency=100, write_workers=4, write_queue_size=100,
+                 fsync_every=0, metrics_port=9750, *, loop=None):
         self.loop = loop or asyncio.get_event_loop()
         self.max_tries = max_tries
         self.max_tasks = max_tasks
@@ -43,21 +67,44 @@ class Crawler(object):
             'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/65.0.3325.181 Safari/537.36',
         }
         self.redis_client = redis.Redis(host='localhost', port=6379, db=15, decode_responses=True)
+        self.task_queue = RedisTaskQueue(aioredis.Redis(host='localhost', port=6379, db=15, decode_responses=True),
+                                         batch_size=batch_size)
+        self.proxy_pool = ProxyPool(self.task_queue.redis_client)
+        self.retry_scheduler = RetryScheduler(self.task_queue.redis_client, self.task_queue, max_tries=max_tries)
+        self.fingerprints = FingerprintStore(self.task_queue.redis_client)
+        # detail and download urls already queued once, pass a ScalableBloomFilter to keep it in-process
+        self.seen_filter = seen_filter or RedisBloomFilter(self.task_queue.redis_client, 'seen', error_rate=0.001)
         self.start_page_key = 'start_page'
         self.detail_page_key = 'detail_page'
         self.download_page_key = 'download_page'
-        # self.download_semaphore = asyncio.Semaphore(40)
-        self.semaphore = asyncio.Semaphore(30)
+        # parsing runs on a process pool, fetchers wait on the bounded queue when it falls behind
+        self.parse_stage = ParseStage(self.handle_parsed, workers=parse_workers, queue_size=parse_queue_size)
+        self.parse_targets = {
+            parse_detail_task: self.detail_page_key,
+            parse_download_task: self.download_page_key,
+        }
+        # per-host requests/second and an AIMD concurrency limit instead of one global semaphore
+        self.throttle = HostThrottle(rate=host_rate, maximum=host_max_concurrency)
+        self.image_writer = ImageWriter(workers=write_workers, queue_size=write_queue_size, fsync_every=fsync_every,
+                                        on_written=lambda path, size: self.stage_counter.inc(stage='saved'))
+        self.metrics_port = metrics_port
+        self.metrics = MetricsRegistry()
+        self.stage_counter = self.metrics.counter('crawler_tasks_total', 'Tasks by outcome', ('stage',))
+        self.fetch_latency = self.metrics.histogram('crawler_fetch_seconds', 'Fetch latency', ('key',))
+        self.response_size = self.metrics.histogram('crawler_response_bytes', 'Response body size', ('key',),
+                                                    buckets=SIZE_BUCKETS)
+        self.queue_depth = self.metrics.gauge('crawler_queue_depth', 'Pending tasks per queue', ('queue',))
+        self.metrics.add_collector(self.collect_queue_depth)
         self.handle_failed_semaphore = asyncio.Semaphore(10)
-        self.q = Queue(loop=self.loop)
+        self.q = Queue()
 
     async def start_task(self):
         while True:
-            await self.create_task(self.start_page_key, self.parse_detail_task)
+            await self.create_task(self.start_page_key, parse_detail_task)
 
     async def detail_task(self):
         while True:
-            await self.create_task(self.detail_page_key, self.parse_download_task)
+            await self.create_task(self.detail_page_key, parse_download_task)
 
     async def download_task(self):
         while True:
@@ -68,110 +115,182 @@ class Crawler(object):
                 continue
             content = await self.fetch(json_data['url'], self.download_page_key, task, type_='content')
             if content is not None:
-                self.loop.run_in_executor(None, self.save_image, json_data['path'], content)
+                # waits here when the writer is behind, so pending images cannot pile up in memory;
+                # the lease is only acknowledged once the image is on disk
+                await self.image_writer.put(json_data['path'], content,
+                                            callback=functools.partial(self.ack_task, self.download_page_key, task))
 
     async def handle_failed_task(self):
         while True:
             async with self.handle_failed_semaphore:
                 redis_key, task = await self.q.get()
-                self.loop.run_in_executor(None, self.insert_task, redis_key, task)
+                await self.task_queue.push(redis_key, task)
                 logging.info('handle failed task: {}'.format(task))
                 self.q.task_done()
 
     def get_proxy(self):
-        try:
-            proxy = random.choice(self.redis_client.keys('http://*'))
-        except:
-            return None
-        return proxy
+        return self.proxy_pool.get()
 
     async def close(self):
         await self.session.close()
+        await self.metrics.close()
+        await self.image_writer.close()
+        await self.task_queue.close()
+        self.parse_stage.close()
 
     async def get_task(self, redis_key):
-        task = self.redis_client.spop(redis_key)
-        self.redis_client.sadd('cache', task)
+        task = await self.task_queue.pop(redis_key)
         return task, (task is not None) and json.loads(task)
 
-    async def parse_detail_task(self, text, json_data):
-        selector = etree.HTML(text)
-        for sel in selector.xpath('//*[@class="gallery_image"]'):
-            xpath_ = './/img[@class="img-responsive img-rounded"]/@src'
-            category = re.findall('ua/(.*?)/page', json_data['url'])[0]
-            image_dir, image_number = re.findall('/mini/(\d+)/(\d+)\.jpg', sel.xpath(xpath_)[0])[0]
-            meta = {
-                'url': sel.xpath('./@href')[0],
-                'image_number': image_number,
-                'image_dir': image_dir,
-                'category': category,
-            }
-            self.loop.run_in_executor(None, self.insert_task, self.detail_page_key, json.dumps(meta))
-
-    async def parse_download_task(self, text, json_data):
-        base_url = 'https://look.com.ua/pic'
-        selector = etree.HTML(text)
-        for url in selector.xpath('//*[@class="llink list-inline"]/li/a/@href'):
-            resolution = re.findall(r'download/\d+/(\d+x\d+)/', url)[0]
-            # path = os.path.join(os.path.abspath('.'), 'images', json_data['category'],
-            #                     json_data['image_number'], resolution + '.jpg')
-            path = os.path.join(os.path.abspath('E:\\'), 'images', json_data['category'],
-                                json_data['image_number'], resolution + '.jpg')
-            url = '/'.join([base_url, json_data['image_dir'], resolution,
-                            'look.com.ua-' + json_data['image_number'] + '.jpg'])
-            if os.path.exists(path):
-                logging.info('image {} already downloaded'.format(path))
-                continue
-            meta = {'url': url, 'path': path, }
-            self.loop.run_in_executor(None, self.insert_task, self.download_page_key, json.dumps(meta))
+    async def ack_task(self, redis_key, task):
+        self.task_queue.ack(redis_key, task)
 
-    async def create_task(self, redis_key, operate_func):
-        async with self.semaphore:
-            task, json_data = await self.get_task(redis_key)
-            if task is None:
-                await asyncio.sleep(10)
-            else:
-                url = json_data['url']
-                html = await self.fetch(url, redis_key, task)
-                if html is not None:
-                    await operate_func(html, json_data)
+    async def handle_parsed(self, parser, json_data, tasks, context):
+        redis_key, task, fingerprint = context
+        if tasks is not None:
+            self.stage_counter.inc(stage='parsed')
+            await self.insert_task(self.parse_targets[parser], *tasks)
+            if fingerprint is not None:
+                # only now: a refetch before this point must not look unchanged
+                await self.fingerprints.save(json_data['url'], *fingerprint)
+        # a page that does not parse would fail the same way again, so it is acknowledged as well
+        self.task_queue.ack(redis_key, task)
 
-    def insert_task(self, redis_key, task):
-        self.redis_client.sadd(redis_key, task)
+    async def create_task(self, redis_key, parser):
+        task, json_data = await self.get_task(redis_key)
+        if task is None:
+            await asyncio.sleep(10)
+        else:
+            url = json_data['url']
+            html, fingerprint = await self.fetch(url, redis_key, task, conditional=True)
+            if html is UNCHANGED:
+                # nothing new on the page since the last crawl, skip parsing and enqueueing
+                self.task_queue.ack(redis_key, task)
+            elif html is not None:
+                await self.parse_stage.put(parser, html, json_data, context=(redis_key, task, fingerprint))
 
-    async def fetch(self, url, key, value, type_='text'):
-        logging.info('active tasks count: {}'.format(len(asyncio.Task.all_tasks())))
+    async def insert_task(self, redis_key, *tasks):
+        if not tasks:
+            return
+        new = await self.seen_filter.contains_many([task['url'] for task in tasks])
+        tasks = [task for task, is_new in zip(tasks, new) if is_new]
+        if not tasks:
+            return
+        # marked seen only once pushed: a failed push must not lose the urls, a racing
+        # insert of the same url at worst queues it twice
+        await self.task_queue.push(redis_key, *[json.dumps(task) for task in tasks])
+        await self.seen_filter.add_many([task['url'] for task in tasks])
+
+    async def fetch(self, url, key, value, type_='text', conditional=False):
+        """Return the body, None on failure, or UNCHANGED for a ``conditional`` fetch of an unchanged page.
+
+        A ``conditional`` fetch returns ``(body, fingerprint)`` instead, where
+        fingerprint is the ``(old, new)`` pair for FingerprintStore.save when
+        the page changed and None otherwise; saving it is up to the caller.
+        """
+        fingerprint = {}
+        if conditional:
+            try:
+                fingerprint = await self.fingerprints.get(url)
+            except Exception as err:
+                # left un-acked, so the lease sweeper requeues the task
+                logging.error('fingerprint of {} raised {}'.format(url, str(err)))
+                return None, None
+        headers = dict(self.headers, **self.fingerprints.headers(fingerprint))
+        proxy = self.get_proxy()
+        start = time.monotonic()
         try:
-            async with async_timeout.timeout(10):
-                async with self.session.get(url, headers=self.headers, ssl=False, timeout=30, allow_redirects=False,
-                                            proxy=self.get_proxy()) as response:
-                    return await response.read() if type_ == 'content' else await response.text()
+            async with self.throttle.slot(url) as slot, async_timeout.timeout(10):
+                async with self.session.get(url, headers=headers, ssl=False, timeout=30, allow_redirects=False,
+                                            proxy=proxy) as response:
+                    slot.status = response.status
+                    if slot.failed():
+                        raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                          status=response.status, message=response.reason)
+                    if response.status == 304:
+                        body = UNCHANGED
+                    else:
+                        body = await response.read() if type_ == 'content' else await response.text()
+            self.proxy_pool.record(proxy, True, time.monotonic() - start)
+            self.stage_counter.inc(stage='fetched')
+            self.fetch_latency.observe(time.monotonic() - start, key=key)
+            changed = None
+            if body is UNCHANGED:
+                await self.fingerprints.touch(url)
+            else:
+                self.response_size.observe(len(body), key=key)
+                if conditional:
+                    new = self.fingerprints.build(response.headers, body)
+                    if self.fingerprints.changed(fingerprint, new):
+                        changed = (fingerprint, new)
+                    else:
+                        # same body, nothing will be enqueued, so storing it now is safe
+                        await self.fingerprints.save(url, fingerprint, new)
+                        body = UNCHANGED
+            if body is UNCHANGED:
+                self.stage_counter.inc(stage='unchanged')
+            return (body, changed) if conditional else body
         except Exception as err:
+            self.proxy_pool.record(proxy, False, time.monotonic() - start)
+            self.stage_counter.inc(stage='failed')
             if isinstance(err, concurrent.futures._base.TimeoutError):
                 logging.warning('{} raised TimeoutError'.format(url))
             else:
                 logging.warning('{} raised {}'.format(url, str(err)))
-            self.loop.run_in_executor(None, self.insert_task, key, value)
-            return None
-
-    def save_image(self, path, content):
-        if not os.path.exists('\\'.join(path.split('\\')[:-1])):
-            os.makedirs('\\'.join(path.split('\\')[:-1]))
-        with open(path, 'wb') as f:
-            f.write(content)
-        logging.info('{}: downloaded'.format(path))
-
-    async def crawl(self):
-        """Run the crawler until all finished."""
+            try:
+                if await self.retry_scheduler.schedule(key, value):
+                    self.stage_counter.inc(stage='retried')
+                self.task_queue.ack(key, value)
+            except Exception as err:
+                logging.error('retry of {} raised {}, leaving it to the lease sweeper'.format(url, str(err)))
+            return (None, None) if conditional else None
+
+    async def collect_queue_depth(self):
+        redis_client = self.task_queue.redis_client
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for key in (self.start_page_key, self.detail_page_key, self.download_page_key):
+                pipe.scard(key)
+                pipe.scard('{}:dead'.format(key))
+            pipe.zcard(self.retry_scheduler.key)
+            depths = await pipe.execute()
+        for i, key in enumerate((self.start_page_key, self.detail_page_key, self.download_page_key)):
+            self.queue_depth.set(depths[2 * i], queue=key)
+            self.queue_depth.set(depths[2 * i + 1], queue='{}:dead'.format(key))
+            self.queue_depth.set(self.task_queue.qsize(key), queue='{}:prefetched'.format(key))
+        self.queue_depth.set(depths[-1], queue=self.retry_scheduler.key)
+        self.queue_depth.set(self.parse_stage.queue.qsize(), queue='parse')
+        self.queue_depth.set(self.image_writer.queue.qsize(), queue='write')
+
+    def stats(self):
+        stats = {key[0]: value for key, value in self.stage_counter.values.items()}
+        writer = self.image_writer.metrics()
+        stats.update(written_bytes=writer['bytes'], write_errors=writer['errors'])
+        return stats
+
+    async def crawl(self, start_workers=0, detail_workers=0, download_workers=5, report=None, report_interval=60):
+        """Run the crawler until all finished.
+
+        The ``*_workers`` arguments set this process' stage mix; ``report`` is
+        called with ``stats()`` every ``report_interval`` seconds.
+        """
         # step = self.max_tasks // 3
-        workers = []
-        # workers.extend([asyncio.Task(self.start_task(), loop=self.loop) for _ in range(5)])
-        # workers.extend([asyncio.Task(self.detail_task(), loop=self.loop) for _ in range(20)])
-        workers.extend([asyncio.Task(self.download_task(), loop=self.loop) for _ in range(5)])
-        # asyncio.Task(self.start_task(), loop=self.loop)
-        # asyncio.Task(self.detail_task(), loop=self.loop)
-        # asyncio.Task(self.download_task(), loop=self.loop)
+        await self.metrics.serve(port=self.metrics_port)
+        workers = self.parse_stage.start()
+        workers.extend(self.image_writer.start())
+        await self.proxy_pool.refresh()
+        workers.append(asyncio.ensure_future(self.proxy_pool.run()))
+        workers.append(asyncio.ensure_future(self.retry_scheduler.run()))
+        workers.append(asyncio.ensure_future(self.task_queue.run(
+            [self.start_page_key, self.detail_page_key, self.download_page_key])))
+        workers.extend([asyncio.Task(self.start_task(), loop=self.loop) for _ in range(start_workers)])
+        workers.extend([asyncio.Task(self.detail_task(), loop=self.loop) for _ in range(detail_workers)])
+        workers.extend([asyncio.Task(self.download_task(), loop=self.loop) for _ in range(download_workers)])
         while True:
-            await asyncio.sleep(60)
+            await asyncio.sleep(report_interval)
+            logging.info('host limits: {}'.format(self.throttle.snapshot()))
+            logging.info('image writer: {}'.format(self.image_writer.metrics()))
+            if report is not None:
+                report(self.stats())
         # for w in workers:
         #     w.cancel()
 
@@ -217,16 +336,18 @@ def main():
         # ('https://www.look.com.ua/auto/page/{}/', 1559),
         # ('https://www.look.com.ua/girls/page/{}/', 9266),
     ]
-    # loop = asyncio.get_event_loop()
-    loop = ProactorEventLoop()
-    asyncio.set_event_loop(loop)
+    # uvloop when installed, Proactor on Windows, selector otherwise; override with EVENT_LOOP
+    loop = event_loops.install()
     crawler = Crawler(max_tries=5, max_tasks=30)
     for info in source_urls:
+        tasks = []
         for i in range(1, info[1]+1):
             json_data = {
                 'url': info[0].format(i),
             }
-            crawler.insert_task(crawler.start_page_key, json.dumps(json_data))
+            tasks.append(json.dumps(json_data))
+        # start pages are re-seeded on every run, so they bypass the seen filter
+        crawler.redis_client.sadd(crawler.start_page_key, *tasks)
 
     try:
         loop.run_until_complete(crawler.crawl())  # Crawler gonna crawl.
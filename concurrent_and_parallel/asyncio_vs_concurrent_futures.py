@@ -5,31 +5,49 @@ from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import requests
 import aiohttp
 
+try:
+    from . import event_loops
+    from .loop_pool import LoopPool
+except ImportError:
+    import event_loops
+    from loop_pool import LoopPool
+
 
 class Download(object):
-    def __init__(self):
-        self.numbers = range(40)
-        self.base_url = 'http://httpbin.org/get?a={}'
+    """Fetches ``base_url`` once per number with each concurrency strategy.
+
+    Every ``download_with_*`` strategy returns a list of
+    ``(number, value, latency)``; value is None when the request failed.
+    """
+
+    def __init__(self, base_url='http://httpbin.org/get?a={}', numbers=range(40), workers=4):
+        self.numbers = numbers
+        self.base_url = base_url
+        self.workers = workers
 
     def fetch(self, a):
-        r = requests.get(self.base_url.format(a))
-        return r.json()['args']['a']
+        start = time.monotonic()
+        try:
+            r = requests.get(self.base_url.format(a))
+            r.raise_for_status()
+            value = r.json()['args']['a']
+        except Exception:
+            value = None
+        return a, value, time.monotonic() - start
 
     def download_with_requests_threadpoolexecutor(self):
         start = time.time()
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            for num, result in zip(self.numbers, executor.map(self.fetch, self.numbers)):
-                # print('fetch({}) = {}'.format(num, result))
-                pass
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(self.fetch, self.numbers))
         print('Use requests+ThreadPoolExecutor cost: {}'.format(time.time() - start))
+        return results
 
     def download_with_requests_processpoolexecutor(self):
         start = time.time()
-        with ProcessPoolExecutor(max_workers=4) as executor:
-            for num, result in zip(self.numbers, executor.map(self.fetch, self.numbers)):
-                # print('fetch({}) = {}'.format(num, result))
-                pass
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(self.fetch, self.numbers))
         print('Use requests+ProcessPoolExecutor cost: {}'.format(time.time() - start))
+        return results
 
     async def run_scraper_tasks(self, executor):
         loop = asyncio.get_event_loop()
@@ -40,54 +58,52 @@ class Download(object):
             tasks.append(task)
         completed, pending = await asyncio.wait(tasks)
         results = {t.__num: t.result() for t in completed}
-        # for num, result in sorted(results.items(), key=lambda x: x[0]):
-        #     print('fetch({}) = {}'.format(num, result))
+        return [result for num, result in sorted(results.items(), key=lambda x: x[0])]
 
     def download_with_requests_asyncio_threadpoolexecutor(self):
         start = time.time()
-        executor = ThreadPoolExecutor(max_workers=4)
-        event_loop = asyncio.get_event_loop()
-        event_loop.run_until_complete(self.run_scraper_tasks(executor))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            event_loop = asyncio.get_event_loop()
+            results = event_loop.run_until_complete(self.run_scraper_tasks(executor))
         print('Use asyncio+requests+ThreadPoolExecutor cost: {}'.format(time.time() - start))
+        return results
 
-    async def fetch_async(self, a):
-        async with aiohttp.ClientSession() as session:
+    async def fetch_async(self, a, session):
+        start = time.monotonic()
+        try:
             async with session.get(self.base_url.format(a)) as r:
+                r.raise_for_status()
                 data = await r.json()
-        return a, data['args']['a']
+            value = data['args']['a']
+        except Exception:
+            value = None
+        return a, value, time.monotonic() - start
+
+    async def fetch_all(self):
+        # one session for the whole run, so connections are reused between requests
+        async with aiohttp.ClientSession() as session:
+            return await asyncio.gather(*[self.fetch_async(num, session) for num in self.numbers])
 
     def download_with_aiohttp_asyncio(self):
         start = time.time()
-        tasks = [self.fetch_async(num) for num in self.numbers]
         event_loop = asyncio.get_event_loop()
-        results = event_loop.run_until_complete(asyncio.gather(*tasks))
-        # for num, result in zip(self.numbers, results):
-        #     print('fetch({}) = {}'.format(num, result[1]))
+        results = event_loop.run_until_complete(self.fetch_all())
         print('Use asyncio+aiohttp cost: {}'.format(time.time() - start))
-
-    def sub_loop(self, numbers):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        tasks = [self.fetch_async(num) for num in numbers]
-        results = loop.run_until_complete(asyncio.gather(*tasks))
-        # for num, result in results:
-        #     print('fetch({}) = {}'.format(num, result))
-
-    async def run(self, executor, numbers):
-        await asyncio.get_event_loop().run_in_executor(executor, self.sub_loop, numbers)
-
-    def chunks(self, l, size):
-        n = len(l) // size
-        for i in range(0, len(l), n):
-            yield l[i:i + n]
+        return results
 
     def download_with_aiohttp_asyncio_threadpoolexecutor(self):
         start = time.time()
-        executor = ThreadPoolExecutor(max_workers=4)
-        event_loop = asyncio.get_event_loop()
-        tasks = [self.run(executor, chunked) for chunked in self.chunks(self.numbers, 4)]
-        results = event_loop.run_until_complete(asyncio.gather(*tasks))
+        with LoopPool(size=self.workers) as pool:
+            results = pool.map(self.fetch_async, self.numbers)
         print('Use asyncio+aiohttp+ThreadPoolExecutor cost: {}'.format(time.time() - start))
+        return results
+
+    def download_with_aiohttp_asyncio_processpoolexecutor(self):
+        start = time.time()
+        with LoopPool(size=self.workers, processes=True) as pool:
+            results = pool.map(self.fetch_async, self.numbers)
+        print('Use asyncio+aiohttp+ProcessPoolExecutor cost: {}'.format(time.time() - start))
+        return results
 
     def start(self):
         time.sleep(5)
@@ -100,9 +116,12 @@ class Download(object):
         self.download_with_aiohttp_asyncio()
         time.sleep(5)
         self.download_with_aiohttp_asyncio_threadpoolexecutor()
+        time.sleep(5)
+        self.download_with_aiohttp_asyncio_processpoolexecutor()
 
 
 def main():
+    event_loops.install()
     obj = Download()
     obj.start()
 
@@ -0,0 +1,157 @@
+import math
+import hashlib
+
+
+def filter_params(capacity, error_rate):
+    """Bits and hash count for ``capacity`` items at ``error_rate`` false positives."""
+    num_bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+    num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+    return num_bits, num_hashes
+
+
+def bit_offsets(item, num_bits, num_hashes):
+    # double hashing (Kirsch-Mitzenmacher): k offsets out of one digest
+    digest = hashlib.sha1(item.encode('utf-8') if isinstance(item, str) else item).digest()
+    h1 = int.from_bytes(digest[:8], 'big')
+    h2 = int.from_bytes(digest[8:16], 'big') | 1
+    return [(h1 + i * h2) % num_bits for i in range(num_hashes)]
+
+
+class BloomFilter(object):
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits, self.num_hashes = filter_params(capacity, error_rate)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def __contains__(self, item):
+        return all(self.bits[offset >> 3] & (1 << (offset & 7))
+                   for offset in bit_offsets(item, self.num_bits, self.num_hashes))
+
+    def __len__(self):
+        return self.count
+
+    def add(self, item):
+        """Set the item's bits, return True if it was not in the filter before."""
+        new = False
+        for offset in bit_offsets(item, self.num_bits, self.num_hashes):
+            mask = 1 << (offset & 7)
+            if not self.bits[offset >> 3] & mask:
+                self.bits[offset >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+
+class ScalableBloomFilter(object):
+    """In-process Bloom filter that grows instead of saturating.
+
+    When the newest slice reaches its capacity a new one is added with
+    ``growth`` times the capacity and ``tightening`` times the error rate, so
+    the compound false-positive rate stays below ``error_rate``.
+    """
+
+    def __init__(self, initial_capacity=100000, error_rate=0.001, growth=2, tightening=0.5):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.filters = []
+
+    def __contains__(self, item):
+        return any(item in f for f in self.filters)
+
+    def __len__(self):
+        return sum(len(f) for f in self.filters)
+
+    def add(self, item):
+        if item in self:
+            return False
+        if not self.filters or len(self.filters[-1]) >= self.filters[-1].capacity:
+            i = len(self.filters)
+            self.filters.append(BloomFilter(self.initial_capacity * self.growth ** i,
+                                            self.error_rate * (1 - self.tightening) * self.tightening ** i))
+        return self.filters[-1].add(item)
+
+    async def contains_many(self, items):
+        """Which items are new, without adding them; duplicates within ``items`` count once."""
+        seen = set()
+        result = []
+        for item in items:
+            result.append(item not in self and item not in seen)
+            seen.add(item)
+        return result
+
+    async def add_many(self, items):
+        """Same signature as RedisBloomFilter.add_many so the two are interchangeable."""
+        return [self.add(item) for item in items]
+
+
+class RedisBloomFilter(object):
+    """Scalable Bloom filter stored in Redis bitmaps, shared by every crawler.
+
+    Slice ``i`` lives at ``{key}:{i}`` and is sized like the slices of
+    ScalableBloomFilter; the slice count and fill of the newest slice are
+    kept in the ``{key}:meta`` hash. ``add_many`` costs three round-trips per
+    batch: HGETALL of the meta hash, pipelined GETBIT over all slices, then
+    pipelined SETBIT on the newest; ``contains_many`` stops after the GETBITs.
+    ``redis_client`` is a ``redis.asyncio.Redis``.
+    """
+
+    def __init__(self, redis_client, key, initial_capacity=1000000, error_rate=0.001, growth=2, tightening=0.5):
+        self.redis_client = redis_client
+        self.key = key
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+
+    def slice_params(self, i):
+        capacity = self.initial_capacity * self.growth ** i
+        return (capacity,) + filter_params(capacity, self.error_rate * (1 - self.tightening) * self.tightening ** i)
+
+    async def check(self, items):
+        meta = await self.redis_client.hgetall('{}:meta'.format(self.key))
+        slices, count = int(meta.get('slices', 1)), int(meta.get('count', 0))
+        params = [self.slice_params(i) for i in range(slices)]
+
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for item in items:
+                for i, (_, num_bits, num_hashes) in enumerate(params):
+                    for offset in bit_offsets(item, num_bits, num_hashes):
+                        pipe.getbit('{}:{}'.format(self.key, i), offset)
+            bits = await pipe.execute()
+
+        result, seen, position = [], set(), 0
+        for item in items:
+            found = False
+            for _, _, num_hashes in params:
+                found = found or all(bits[position:position + num_hashes])
+                position += num_hashes
+            result.append(not found and item not in seen)
+            seen.add(item)
+        return result, slices, count, params
+
+    async def contains_many(self, items):
+        """Which items are new, without adding them; duplicates within ``items`` count once."""
+        result, _, _, _ = await self.check(items)
+        return result
+
+    async def add_many(self, items):
+        """Add items, return a list of booleans telling which were new."""
+        result, slices, count, params = await self.check(items)
+        new_items = [item for item, new in zip(items, result) if new]
+        if new_items:
+            capacity, num_bits, num_hashes = params[-1]
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for item in new_items:
+                    for offset in bit_offsets(item, num_bits, num_hashes):
+                        pipe.setbit('{}:{}'.format(self.key, slices - 1), offset, 1)
+                if count + len(new_items) >= capacity:
+                    pipe.hset('{}:meta'.format(self.key), mapping={'slices': slices + 1, 'count': 0})
+                else:
+                    pipe.hincrby('{}:meta'.format(self.key), 'count', len(new_items))
+                await pipe.execute()
+        return result
@@ -0,0 +1,171 @@
+import os
+import sys
+import time
+import queue
+import signal
+import logging
+import argparse
+import multiprocessing
+
+try:
+    from . import event_loops
+    from .asyncio_test import Crawler, setup_log
+except ImportError:
+    import event_loops
+    from asyncio_test import Crawler, setup_log
+
+
+def run_worker(index, stage_mix, crawler_kwargs, stats_queue, report_interval):
+    """Entry point of one crawler process: its own event loop, its own stage mix."""
+    setup_log(logging.INFO, os.path.join(os.path.abspath('.'), 'logs', 'look_ua.{}.log'.format(index)))
+    loop = event_loops.install()
+    crawler = Crawler(**crawler_kwargs)
+    try:
+        loop.run_until_complete(crawler.crawl(report=lambda stats: stats_queue.put((index, os.getpid(), stats)),
+                                              report_interval=report_interval, **stage_mix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(crawler.close())
+        loop.close()
+
+
+class Supervisor(object):
+    """Runs one Crawler process per shard and keeps them alive.
+
+    Every shard gets a stage mix (``start_workers``, ``detail_workers``,
+    ``download_workers``); all of them share the Redis queues, so adding
+    processes scales the crawl with the number of cores. A process that
+    exits is restarted after ``restart_delay`` seconds, and the stats each
+    process reports are summed and logged every ``report_interval`` seconds;
+    the last stats of a process that died stay in the totals. ``stop`` gives
+    the crawlers ``stop_timeout`` seconds to close before terminating them.
+    """
+
+    def __init__(self, shards, crawler_kwargs=None, metrics_port=9750, restart_delay=5, report_interval=60,
+                 stop_timeout=30):
+        self.shards = shards
+        self.crawler_kwargs = crawler_kwargs or {}
+        self.metrics_port = metrics_port
+        self.restart_delay = restart_delay
+        self.report_interval = report_interval
+        self.stop_timeout = stop_timeout
+        self.stats_queue = multiprocessing.Queue()
+        self.processes = {}
+        self.exited = {}
+        self.restarts = 0
+        self.stats = {}
+        # counters of crawler processes that exited, so totals do not go backwards on a restart
+        self.base = {}
+
+    def spawn(self, index):
+        kwargs = dict(self.crawler_kwargs, metrics_port=self.metrics_port + index)
+        process = multiprocessing.Process(target=run_worker, name='crawler-{}'.format(index),
+                                          args=(index, self.shards[index], kwargs, self.stats_queue,
+                                                self.report_interval))
+        process.start()
+        self.processes[index] = process
+        logging.info('started crawler-{} (pid {}) with {}'.format(index, process.pid, self.shards[index]))
+
+    def start(self):
+        for index in range(len(self.shards)):
+            self.spawn(index)
+
+    def check(self):
+        now = time.monotonic()
+        for index, process in self.processes.items():
+            if process.is_alive() or index in self.exited:
+                continue
+            logging.warning('crawler-{} exited with code {}, restarting in {}s'.format(
+                index, process.exitcode, self.restart_delay))
+            self.exited[index] = now
+            _, stats = self.stats.pop(index, (None, {}))
+            for name, value in stats.items():
+                self.base[name] = self.base.get(name, 0) + value
+        for index, exited in list(self.exited.items()):
+            if now - exited >= self.restart_delay:
+                del self.exited[index]
+                self.restarts += 1
+                self.spawn(index)
+
+    def collect(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                index, pid, stats = self.stats_queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                return
+            # a late report from a process already folded into base would be counted twice
+            if index not in self.exited and pid == self.processes[index].pid:
+                self.stats[index] = (pid, stats)
+
+    def aggregate(self):
+        total = {'processes': sum(p.is_alive() for p in self.processes.values()), 'restarts': self.restarts}
+        for name, value in self.base.items():
+            total[name] = total.get(name, 0) + value
+        for _, stats in self.stats.values():
+            for name, value in stats.items():
+                total[name] = total.get(name, 0) + value
+        return total
+
+    def run(self):
+        self.start()
+        reported = time.monotonic()
+        interrupted = False
+        try:
+            while True:
+                self.collect(timeout=1)
+                self.check()
+                if time.monotonic() - reported >= self.report_interval:
+                    logging.info('crawl stats: {}'.format(self.aggregate()))
+                    reported = time.monotonic()
+        except KeyboardInterrupt:
+            # Ctrl-C already reached the crawlers (same process group), a second SIGINT would cut their close()
+            interrupted = True
+            raise
+        finally:
+            self.stop(signal_children=not interrupted)
+
+    def stop(self, signal_children=True):
+        alive = [process for process in self.processes.values() if process.is_alive()]
+        if signal_children and sys.platform != 'win32':
+            # run_worker turns SIGINT into KeyboardInterrupt and closes the crawler
+            for process in alive:
+                os.kill(process.pid, signal.SIGINT)
+        deadline = time.monotonic() + self.stop_timeout
+        for process in alive:
+            process.join(max(0, deadline - time.monotonic()))
+        for process in alive:
+            if process.is_alive():
+                logging.warning('{} did not stop in {}s, terminating'.format(process.name, self.stop_timeout))
+                process.terminate()
+                process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='run sharded crawler processes')
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--start-workers', type=int, default=1)
+    parser.add_argument('--detail-workers', type=int, default=4)
+    parser.add_argument('--download-workers', type=int, default=5)
+    parser.add_argument('--metrics-port', type=int, default=9750)
+    args = parser.parse_args()
+
+    setup_log(logging.INFO, os.path.join(os.path.abspath('.'), 'logs', 'supervisor.log'))
+    stage_mix = {
+        'start_workers': args.start_workers,
+        'detail_workers': args.detail_workers,
+        'download_workers': args.download_workers,
+    }
+    # every crawler has its own parse pool, so split the cores between them
+    crawler_kwargs = {'parse_workers': max(1, os.cpu_count() // args.processes)}
+    supervisor = Supervisor([stage_mix] * args.processes, crawler_kwargs, metrics_port=args.metrics_port)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        sys.stderr.flush()
+        logging.warning('\nInterrupted\n')
+
+
+if __name__ == '__main__':
+    main()
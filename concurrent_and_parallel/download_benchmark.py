@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import contextlib
+import multiprocessing
+
+try:
+    from . import event_loops
+    from .asyncio_vs_concurrent_futures import Download
+except ImportError:
+    import event_loops
+    from asyncio_vs_concurrent_futures import Download
+
+STRATEGIES = sorted(name for name in dir(Download) if name.startswith('download_with_'))
+
+
+def serve(port, latency, jitter, payload_size, error_rate, seed):
+    """httpbin-like ``/get?a=`` that answers after ``latency`` (+-``jitter``) seconds."""
+    from aiohttp import web
+
+    rand = random.Random(seed)
+    padding = 'x' * payload_size
+
+    async def handle(request):
+        await asyncio.sleep(max(0, latency + rand.uniform(-jitter, jitter)))
+        if rand.random() < error_rate:
+            return web.Response(status=500, text='injected error')
+        return web.json_response({'args': dict(request.query), 'padding': padding})
+
+    app = web.Application()
+    app.router.add_get('/get', handle)
+    web.run_app(app, host='127.0.0.1', port=port, print=None)
+
+
+def start_server(latency=0.05, jitter=0.0, payload_size=1024, error_rate=0.0, seed=0):
+    port = event_loops.free_port()
+    server = multiprocessing.Process(target=serve, args=(port, latency, jitter, payload_size, error_rate, seed),
+                                     daemon=True)
+    server.start()
+    for _ in range(50):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return server, 'http://127.0.0.1:{}/get?a={{}}'.format(port)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+def cpu_time():
+    # children too, so the worker processes of ProcessPoolExecutor are counted once they are joined
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def measure(base_url, strategy, requests, workers):
+    download = Download(base_url=base_url, numbers=range(requests), workers=workers)
+    cpu, start = cpu_time(), time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):  # keep the strategies' own timing lines out of the JSON
+        results = getattr(download, strategy)()
+    elapsed, cpu = time.perf_counter() - start, cpu_time() - cpu
+    latencies = [latency for _, value, latency in results if value is not None]
+    return {
+        'strategy': strategy,
+        'requests': requests,
+        'workers': workers,
+        'seconds': round(elapsed, 4),
+        'throughput': round(requests / elapsed, 1),
+        'errors': len(results) - len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'cpu_seconds': round(cpu, 4),
+    }
+
+
+def benchmark(strategies=STRATEGIES, requests=(50, 200), workers=(4, 16), repeat=1, latency=0.05, jitter=0.0,
+              payload_size=1024, error_rate=0.0, seed=0):
+    """Every strategy against a local server, for each request count and worker count."""
+    server, base_url = start_server(latency, jitter, payload_size, error_rate, seed)
+    try:
+        measure(base_url, STRATEGIES[0], 10, 2)  # warm up imports and the server
+        results = []
+        for strategy in strategies:
+            for count in requests:
+                for worker_count in workers:
+                    for run in range(repeat):
+                        result = measure(base_url, strategy, count, worker_count)
+                        result['run'] = run
+                        results.append(result)
+        return {
+            'server': {'latency': latency, 'jitter': jitter, 'payload_size': payload_size,
+                       'error_rate': error_rate, 'seed': seed},
+            'event_loop': event_loops.loop_name(),
+            'python': sys.version.split()[0],
+            'cpu_count': os.cpu_count(),
+            'results': results,
+        }
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the Download strategies against a local server')
+    parser.add_argument('--strategy', action='append', choices=STRATEGIES, help='default: all of them')
+    parser.add_argument('--requests', type=int, nargs='+', default=[50, 200])
+    parser.add_argument('--workers', type=int, nargs='+', default=[4, 16])
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.05, help='server response delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--payload-size', type=int, default=1024, help='bytes of padding in every response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of responses that are 500s')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    args = parser.parse_args()
+    event_loops.install()
+    report = benchmark(args.strategy or STRATEGIES, args.requests, args.workers, args.repeat, args.latency,
+                       args.jitter, args.payload_size, args.error_rate, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import json
+import socket
+import asyncio
+import multiprocessing
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# EVENT_LOOP=auto|uvloop|selector|proactor, shared by Crawler, Download and any other asyncio entry point
+LOOP_ENV = 'EVENT_LOOP'
+
+
+def available_loops():
+    loops = ['selector']
+    if uvloop is not None:
+        loops.insert(0, 'uvloop')
+    if sys.platform == 'win32':
+        loops.append('proactor')
+    return loops
+
+
+def loop_name(name=None):
+    """Resolve ``name`` (default: $EVENT_LOOP or 'auto') to a concrete loop.
+
+    'auto' prefers uvloop when it is installed (``pip install uvloop``), then
+    Proactor on Windows and the default selector loop everywhere else.
+    """
+    name = name or os.environ.get(LOOP_ENV, 'auto')
+    if name == 'auto':
+        if uvloop is not None:
+            return 'uvloop'
+        return 'proactor' if sys.platform == 'win32' else 'selector'
+    if name not in available_loops():
+        raise ValueError('event loop {} is not available here, choose from {}'.format(name, available_loops()))
+    return name
+
+
+def new_event_loop(name=None):
+    name = loop_name(name)
+    if name == 'uvloop':
+        return uvloop.new_event_loop()
+    if name == 'proactor':
+        return asyncio.ProactorEventLoop()
+    return asyncio.SelectorEventLoop()
+
+
+def install(name=None):
+    """Create the configured loop and make it the current one."""
+    loop = new_event_loop(name)
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+def serve(port, payload_size):
+    from aiohttp import web
+
+    body = b'x' * payload_size
+
+    async def handle(request):
+        return web.Response(body=body)
+
+    app = web.Application()
+    app.router.add_get('/', handle)
+    web.run_app(app, host='127.0.0.1', port=port, print=None)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def hammer(url, requests, concurrency):
+    import aiohttp
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(session):
+        async with semaphore:
+            async with session.get(url) as response:
+                await response.read()
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        await fetch(session)  # warm up the connection pool
+        start = time.perf_counter()
+        await asyncio.gather(*[fetch(session) for _ in range(requests)])
+        return time.perf_counter() - start
+
+
+def benchmark(requests=5000, concurrency=100, payload_size=1024):
+    """Requests per second against a local server for every available loop."""
+    port = free_port()
+    server = multiprocessing.Process(target=serve, args=(port, payload_size), daemon=True)
+    server.start()
+    url = 'http://127.0.0.1:{}/'.format(port)
+    try:
+        for _ in range(50):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        results = {}
+        for name in available_loops():
+            loop = new_event_loop(name)
+            try:
+                elapsed = loop.run_until_complete(hammer(url, requests, concurrency))
+            finally:
+                loop.close()
+            results[name] = {'requests_per_second': round(requests / elapsed, 1), 'seconds': round(elapsed, 3)}
+        return results
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main():
+    print(json.dumps(benchmark(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import hashlib
+
+UNCHANGED = object()
+
+
+def url_key(prefix, url):
+    return '{}:{}'.format(prefix, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+
+class FingerprintStore(object):
+    """ETag, Last-Modified and body hash of every crawled page, in Redis.
+
+    ``headers`` turns a stored fingerprint into conditional request headers;
+    ``build`` fingerprints a fresh response and ``changed`` tells whether the
+    page changed, so recrawls can skip parsing pages that came back 304 or
+    byte-identical. ``save`` a changed page's fingerprint only once its links
+    are queued, or a crash in between would make the refetch look unchanged.
+    Fingerprints expire after ``ttl`` seconds without a refetch.
+    """
+
+    def __init__(self, redis_client, prefix='fingerprint', ttl=30 * 24 * 3600):
+        self.redis_client = redis_client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    async def get(self, url):
+        return await self.redis_client.hgetall(url_key(self.prefix, url))
+
+    @staticmethod
+    def headers(fingerprint):
+        headers = {}
+        if fingerprint.get('etag'):
+            headers['If-None-Match'] = fingerprint['etag']
+        if fingerprint.get('last_modified'):
+            headers['If-Modified-Since'] = fingerprint['last_modified']
+        return headers
+
+    @staticmethod
+    def build(response_headers, body):
+        return {
+            'etag': response_headers.get('ETag', ''),
+            'last_modified': response_headers.get('Last-Modified', ''),
+            'hash': hashlib.sha1(body.encode('utf-8') if isinstance(body, str) else body).hexdigest(),
+        }
+
+    @staticmethod
+    def changed(fingerprint, new):
+        return new['hash'] != fingerprint.get('hash')
+
+    async def save(self, url, fingerprint, new):
+        key = url_key(self.prefix, url)
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            if new != fingerprint:
+                pipe.hset(key, mapping=new)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def touch(self, url):
+        await self.redis_client.expire(url_key(self.prefix, url), self.ttl)
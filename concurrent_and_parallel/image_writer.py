@@ -0,0 +1,86 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ImageWriter(object):
+    """Writes downloaded files from a bounded queue on a dedicated thread pool.
+
+    ``put`` blocks once ``queue_size`` files are waiting, which holds back the
+    downloaders instead of letting pending bodies fill memory. Each file is
+    written to a per-thread ``<path>.<thread id>.tmp`` and renamed into place,
+    so a crash never leaves a truncated image behind and two writes of the same
+    path never share a temp file. ``fsync_every`` is the fsync policy: 0 never,
+    1 after every file, N after every Nth file. ``on_written(path, size)`` is
+    called from the writer thread after each file lands; the optional
+    ``callback`` given to ``put`` is awaited on the loop once its file is written.
+    """
+
+    def __init__(self, workers=4, queue_size=100, fsync_every=0, on_written=None):
+        self.workers = workers
+        self.fsync_every = fsync_every
+        self.on_written = on_written
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.created_dirs = set()
+        self.stats = {'files': 0, 'bytes': 0, 'errors': 0, 'write_seconds': 0.0}
+        self.started = time.monotonic()
+        self.__lock = threading.Lock()
+
+    async def put(self, path, content, callback=None):
+        await self.queue.put((path, content, callback))
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            path, content, callback = await self.queue.get()
+            try:
+                await loop.run_in_executor(self.executor, self.write, path, content)
+                if callback is not None:
+                    await callback()
+            except Exception as err:
+                self.stats['errors'] += 1
+                logging.warning('write {} raised {}'.format(path, str(err)))
+            finally:
+                self.queue.task_done()
+
+    def write(self, path, content):
+        start = time.monotonic()
+        directory = os.path.dirname(path)
+        if directory not in self.created_dirs:
+            os.makedirs(directory, exist_ok=True)
+            self.created_dirs.add(directory)
+        with self.__lock:
+            count = self.stats['files'] + 1
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+            if self.fsync_every and count % self.fsync_every == 0:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        with self.__lock:
+            self.stats['files'] += 1
+            self.stats['bytes'] += len(content)
+            self.stats['write_seconds'] += time.monotonic() - start
+        if self.on_written is not None:
+            self.on_written(path, len(content))
+        logging.info('{}: downloaded'.format(path))
+
+    def start(self):
+        self.started = time.monotonic()
+        return [asyncio.ensure_future(self.run()) for _ in range(self.workers)]
+
+    def metrics(self):
+        elapsed = time.monotonic() - self.started
+        return dict(self.stats, pending=self.queue.qsize(),
+                    files_per_second=round(self.stats['files'] / elapsed, 2) if elapsed else 0,
+                    bytes_per_second=round(self.stats['bytes'] / elapsed) if elapsed else 0)
+
+    async def close(self):
+        """Wait for queued files to be written, then stop the thread pool."""
+        await self.queue.join()
+        self.executor.shutdown(wait=True)
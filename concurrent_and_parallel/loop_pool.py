@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+
+try:
+    from . import event_loops
+except ImportError:
+    import event_loops
+
+
+def chunks(items, count):
+    """Split ``items`` into at most ``count`` contiguous, nearly equal slices."""
+    items = list(items)
+    size = -(-len(items) // max(1, count))
+    return [items[i:i + size] for i in range(0, len(items), size or 1)]
+
+
+class LoopThread(object):
+    """An event loop running forever on its own thread, with one long-lived session.
+
+    Coroutine functions run on it are called as ``func(*args, session=session)``,
+    so every call shares the session's connection pool. ``pending`` is the
+    number of calls submitted and not yet finished.
+    """
+
+    def __init__(self, session_factory=aiohttp.ClientSession, name=None):
+        self.loop = event_loops.new_event_loop()
+        self.pending = 0
+        self.__lock = threading.Lock()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+        self.session = self.call(self.open, session_factory).result()
+
+    @staticmethod
+    async def open(session_factory):
+        # aiohttp sessions must be created on the loop that uses them
+        return session_factory()
+
+    def call(self, coro_func, *args):
+        return asyncio.run_coroutine_threadsafe(coro_func(*args), self.loop)
+
+    def submit(self, func, *args):
+        with self.__lock:
+            self.pending += 1
+        future = self.call(self.run, func, *args)
+        future.add_done_callback(self.done)
+        return future
+
+    def done(self, future):
+        with self.__lock:
+            self.pending -= 1
+
+    async def run(self, func, *args):
+        return await func(*args, session=self.session)
+
+    async def run_all(self, func, args_list):
+        return await asyncio.gather(*[self.run(func, *args) for args in args_list])
+
+    def gather(self, func, args_list):
+        return self.call(self.run_all, func, args_list).result()
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.call(self.session.close).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+process_loop = None
+
+
+def init_process(session_factory):
+    global process_loop
+    process_loop = LoopThread(session_factory, name='loop-pool')
+    # pool workers leave through os._exit, so atexit would not close the session
+    multiprocessing.util.Finalize(None, process_loop.close, exitpriority=10)
+
+
+def run_in_process(func, args_list):
+    return process_loop.gather(func, args_list)
+
+
+def run_one_in_process(func, args):
+    return process_loop.gather(func, [args])[0]
+
+
+class LoopPool(object):
+    """Runs coroutine functions on ``size`` event loops, each with its own long-lived session.
+
+    With ``processes=False`` the loops run on threads of this process and
+    every call goes to the loop with the fewest pending calls. With
+    ``processes=True`` each loop lives in a ProcessPoolExecutor worker, set
+    up once by the pool initializer, and ``map`` sends ``chunks_per_loop``
+    batches per loop, which idle workers pick up first. ``func`` must then
+    be picklable. Either way ``map`` returns results in input order.
+    """
+
+    def __init__(self, size=4, processes=False, session_factory=aiohttp.ClientSession, chunks_per_loop=4):
+        self.size = size
+        self.processes = processes
+        self.chunks_per_loop = chunks_per_loop
+        self.loops = []
+        self.executor = None
+        if processes:
+            self.executor = ProcessPoolExecutor(max_workers=size, initializer=init_process,
+                                                initargs=(session_factory,))
+        else:
+            self.loops = [LoopThread(session_factory, name='loop-pool-{}'.format(i)) for i in range(size)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def loads(self):
+        return [loop.pending for loop in self.loops]
+
+    def submit(self, func, *args):
+        """concurrent.futures.Future of ``func(*args, session=...)``; wrap it with asyncio.wrap_future to await it."""
+        if self.processes:
+            return self.executor.submit(run_one_in_process, func, args)
+        return min(self.loops, key=lambda loop: loop.pending).submit(func, *args)
+
+    def map(self, func, *iterables):
+        args_list = list(zip(*iterables))
+        if self.processes:
+            batches = chunks(args_list, self.size * self.chunks_per_loop)
+            futures = [self.executor.submit(run_in_process, func, batch) for batch in batches]
+            return [result for future in futures for result in future.result()]
+        futures = [self.submit(func, *args) for args in args_list]
+        return [future.result() for future in futures]
+
+    def close(self):
+        for loop in self.loops:
+            loop.close()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+async def fetch_status(url, session):
+    async with session.get(url) as response:
+        await response.read()
+        return response.status
+
+
+def main():
+    urls = ['http://httpbin.org/get?a={}'.format(i) for i in range(40)]
+    with LoopPool(size=4) as pool:
+        print(pool.map(fetch_status, urls))
+    with LoopPool(size=2, processes=True) as pool:
+        print(pool.map(fetch_status, urls))
+
+
+if __name__ == '__main__':
+    main()
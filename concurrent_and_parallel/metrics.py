@@ -0,0 +1,148 @@
+import math
+import logging
+import threading
+
+from aiohttp import web
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(n, str(v).replace('"', '\\"')) for n, v in zip(names, values)) + '}'
+
+
+class Metric(object):
+    type_ = None
+
+    def __init__(self, name, help_, labels=()):
+        self.name = name
+        self.help = help_
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} {}'.format(self.name, self.type_)]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append('{}{} {}'.format(self.name, format_labels(self.labels, key), value))
+        return lines
+
+
+class Counter(Metric):
+    type_ = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    type_ = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    type_ = 'histogram'
+
+    def __init__(self, name, help_, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        names = self.labels + ('le',)
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    le = '+Inf' if bound == math.inf else bound
+                    lines.append('{}_bucket{} {}'.format(self.name, format_labels(names, key + (le,)), count))
+                lines.append('{}_sum{} {}'.format(self.name, format_labels(self.labels, key), total))
+                lines.append('{}_count{} {}'.format(self.name, format_labels(self.labels, key), counts[-1]))
+        return lines
+
+
+class MetricsRegistry(object):
+    """Counters, gauges and histograms rendered in the Prometheus text format.
+
+    Metrics are safe to update from worker threads. ``add_collector``
+    registers a coroutine that runs before every scrape, e.g. to refresh
+    gauges from Redis; one that raises is logged and skipped. ``serve``
+    exposes ``/metrics`` on a local port.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self.runner = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_, labels=()):
+        return self.register(Counter(name, help_, labels))
+
+    def gauge(self, name, help_, labels=()):
+        return self.register(Gauge(name, help_, labels))
+
+    def histogram(self, name, help_, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_, labels, buckets))
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    async def handle(self, request):
+        for collector in self.collectors:
+            try:
+                await collector()
+            except Exception as err:
+                # the other collectors and the in-process metrics are still worth serving
+                logging.warning('metrics collector {} raised {}'.format(getattr(collector, '__name__', collector),
+                                                                       str(err)))
+        return web.Response(text=self.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def serve(self, host='127.0.0.1', port=9750):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, host, port).start()
+        except OSError as err:
+            # metrics are optional, a taken port must not stop the caller
+            logging.warning('metrics endpoint on {}:{} raised {}, not serving metrics'.format(host, port, str(err)))
+            await self.runner.cleanup()
+            self.runner = None
+            return False
+        return True
+
+    async def close(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
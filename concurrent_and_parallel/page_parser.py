@@ -0,0 +1,117 @@
+import os
+import re
+import asyncio
+import logging
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from lxml import etree
+
+
+def parse_detail_task(text, json_data):
+    """Start (listing) page -> detail page tasks."""
+    selector = etree.HTML(text)
+    tasks = []
+    for sel in selector.xpath('//*[@class="gallery_image"]'):
+        xpath_ = './/img[@class="img-responsive img-rounded"]/@src'
+        category = re.findall('ua/(.*?)/page', json_data['url'])[0]
+        image_dir, image_number = re.findall(r'/mini/(\d+)/(\d+)\.jpg', sel.xpath(xpath_)[0])[0]
+        meta = {
+            'url': sel.xpath('./@href')[0],
+            'image_number': image_number,
+            'image_dir': image_dir,
+            'category': category,
+        }
+        tasks.append(meta)
+    return tasks
+
+
+def parse_download_task(text, json_data):
+    """Detail page -> image download tasks."""
+    base_url = 'https://look.com.ua/pic'
+    selector = etree.HTML(text)
+    tasks = []
+    for url in selector.xpath('//*[@class="llink list-inline"]/li/a/@href'):
+        resolution = re.findall(r'download/\d+/(\d+x\d+)/', url)[0]
+        # path = os.path.join(os.path.abspath('.'), 'images', json_data['category'],
+        #                     json_data['image_number'], resolution + '.jpg')
+        path = os.path.join(os.path.abspath('E:\\'), 'images', json_data['category'],
+                            json_data['image_number'], resolution + '.jpg')
+        url = '/'.join([base_url, json_data['image_dir'], resolution,
+                        'look.com.ua-' + json_data['image_number'] + '.jpg'])
+        meta = {'url': url, 'path': path, }
+        tasks.append(meta)
+    return tasks
+
+
+def parse_batch(batch):
+    """Runs in a worker process: ``[(parser, text, json_data)]`` -> ``[(parser, json_data, tasks)]``.
+
+    A page that fails to parse yields ``None`` as its tasks instead of failing
+    the rest of the batch.
+    """
+    results = []
+    for parser, text, json_data in batch:
+        try:
+            results.append((parser, json_data, parser(text, json_data)))
+        except Exception:
+            logging.warning('parse {} failed:\n{}'.format(json_data['url'], traceback.format_exc()))
+            results.append((parser, json_data, None))
+    return results
+
+
+class ParseStage(object):
+    """Pipeline stage that runs the lxml parsers on a process pool.
+
+    Fetchers ``put`` raw HTML into a bounded queue, so they block instead of
+    piling up pages when parsing falls behind. ``workers`` consumer coroutines
+    each drain up to ``batch_size`` pages, parse them in one executor call and
+    hand every ``(parser, json_data, tasks, context)`` result to
+    ``handle_result``; ``context`` stays in this process and is passed through
+    untouched.
+    """
+
+    def __init__(self, handle_result, workers=None, queue_size=100, batch_size=10):
+        self.handle_result = handle_result
+        self.workers = workers or os.cpu_count()
+        self.batch_size = batch_size
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.executor = None
+
+    async def put(self, parser, text, json_data, context=None):
+        await self.queue.put((parser, text, json_data, context))
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                results = await loop.run_in_executor(self.executor, parse_batch, [item[:3] for item in batch])
+            except Exception as err:
+                # the pages stay un-acked, their leases expire and they are fetched again
+                logging.warning('parse batch of {} raised {!r}'.format(len(batch), err))
+                if isinstance(err, BrokenProcessPool):
+                    self.restart_executor()
+                results = []
+            for result, item in zip(results, batch):
+                try:
+                    await self.handle_result(*result, item[3])
+                except Exception as err:
+                    logging.warning('handle {} raised {!r}'.format(item[2].get('url'), err))
+            for _ in batch:
+                self.queue.task_done()
+
+    def restart_executor(self):
+        broken, self.executor = self.executor, ProcessPoolExecutor(max_workers=self.workers)
+        broken.shutdown(wait=False)
+
+    def start(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return [asyncio.ensure_future(self.run()) for _ in range(self.workers)]
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
@@ -0,0 +1,84 @@
+import time
+import random
+import asyncio
+import logging
+
+
+class ProxyStats(object):
+    def __init__(self):
+        self.success_rate = 1.0
+        self.latency = 1.0
+        self.failures = 0
+
+    def record(self, ok, latency, alpha=0.2):
+        self.success_rate += (ok - self.success_rate) * alpha
+        if ok:
+            self.latency += (latency - self.latency) * alpha
+            self.failures = 0
+        else:
+            self.failures += 1
+
+    def score(self):
+        return self.success_rate / (1 + self.latency)
+
+
+class ProxyPool(object):
+    """Local copy of the proxies in Redis, scored by how they perform for us.
+
+    ``run`` refreshes the pool in the background with SCAN (never KEYS) every
+    ``refresh_interval`` seconds. ``get`` picks a proxy at random weighted by
+    success rate and latency; ``record`` feeds back each fetch outcome. A
+    proxy failing ``max_failures`` times in a row is evicted and ignored by
+    refreshes for ``eviction_ttl`` seconds.
+    """
+
+    def __init__(self, redis_client, match='http://*', refresh_interval=30, max_failures=5, eviction_ttl=600):
+        self.redis_client = redis_client
+        self.match = match
+        self.refresh_interval = refresh_interval
+        self.max_failures = max_failures
+        self.eviction_ttl = eviction_ttl
+        self.proxies = {}
+        self.evicted = {}
+
+    async def refresh(self):
+        found = set()
+        async for key in self.redis_client.scan_iter(match=self.match, count=1000):
+            found.add(key)
+        now = time.monotonic()
+        self.evicted = {proxy: until for proxy, until in self.evicted.items() if until > now}
+        for proxy in list(self.proxies):
+            if proxy not in found:
+                del self.proxies[proxy]
+        for proxy in found:
+            if proxy not in self.proxies and proxy not in self.evicted:
+                self.proxies[proxy] = ProxyStats()
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as err:
+                logging.warning('refresh proxies raised {}'.format(str(err)))
+            await asyncio.sleep(self.refresh_interval)
+
+    def get(self):
+        if not self.proxies:
+            return None
+        proxies = list(self.proxies)
+        return random.choices(proxies, weights=[self.proxies[p].score() for p in proxies])[0]
+
+    def record(self, proxy, ok, latency):
+        stats = self.proxies.get(proxy)
+        if stats is None:
+            return
+        stats.record(ok, latency)
+        if stats.failures >= self.max_failures:
+            del self.proxies[proxy]
+            self.evicted[proxy] = time.monotonic() + self.eviction_ttl
+            logging.info('evict proxy {}'.format(proxy))
+
+    def snapshot(self):
+        return {proxy: {'score': round(stats.score(), 3), 'success_rate': round(stats.success_rate, 3),
+                        'latency': round(stats.latency, 3)}
+                for proxy, stats in self.proxies.items()}
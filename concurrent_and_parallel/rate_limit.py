@@ -0,0 +1,161 @@
+import time
+import asyncio
+from collections import deque
+from urllib.parse import urlparse
+
+
+class TokenBucket(object):
+    """``rate`` requests per second on average, bursts of up to ``capacity``."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveLimiter(object):
+    """Concurrency limit adjusted by AIMD (additive increase, multiplicative decrease).
+
+    Every healthy response (no error, latency below ``latency_threshold``)
+    grows the limit by ``1 / limit``, i.e. about one slot per window of
+    requests. A timeout, 429 or 5xx multiplies it by ``backoff``, at most once
+    per ``cooldown`` seconds so a burst of failures from one bad moment does
+    not collapse it to ``minimum``. Any other error (dead proxy, broken
+    payload, bad encoding) says nothing about the origin's capacity and is
+    released with ``ok=None``, leaving the limit as it is.
+    """
+
+    def __init__(self, initial=10, minimum=1, maximum=100, backoff=0.5, latency_threshold=5.0, cooldown=1.0):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.latency_threshold = latency_threshold
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.decreased = 0
+        self.waiters = deque()
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_event_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self, ok, latency):
+        self.in_flight -= 1
+        if ok and latency < self.latency_threshold:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        elif ok is False and time.monotonic() - self.decreased > self.cooldown:
+            self.limit = max(self.minimum, self.limit * self.backoff)
+            self.decreased = time.monotonic()
+        for _ in range(int(self.limit) - self.in_flight):
+            if not self.waiters:
+                break
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+class Slot(object):
+    """One request's share of a host: ``async with throttle.slot(url) as slot``.
+
+    Set ``slot.status`` to the response status. A 429/5xx status or a timeout
+    makes the host back off; other exceptions count as errors in the host
+    stats but do not touch its concurrency limit.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.status = None
+        self.started = None
+
+    def failed(self):
+        return self.status is not None and (self.status == 429 or self.status >= 500)
+
+    async def __aenter__(self):
+        await self.host.limiter.acquire()
+        try:
+            await self.host.bucket.acquire()
+        except BaseException:
+            self.host.limiter.release(None, 0)
+            raise
+        self.started = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        latency = time.monotonic() - self.started
+        if self.failed() or (exc_type is not None and issubclass(exc_type, asyncio.TimeoutError)):
+            ok = False
+        elif exc_type is not None:
+            ok = None
+        else:
+            ok = True
+        self.host.record(ok is True, latency)
+        self.host.limiter.release(ok, latency)
+
+
+class HostState(object):
+    def __init__(self, rate, burst, **limiter_kwargs):
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AdaptiveLimiter(**limiter_kwargs)
+        self.requests = 0
+        self.errors = 0
+        self.latency = 0.0
+
+    def record(self, ok, latency):
+        self.requests += 1
+        self.errors += not ok
+        # exponentially weighted, so the snapshot reflects the last ~20 requests
+        self.latency += (latency - self.latency) * 0.05
+
+
+class HostThrottle(object):
+    """Per-host token bucket plus adaptive concurrency limit, created on first use."""
+
+    def __init__(self, rate=10, burst=None, **limiter_kwargs):
+        self.rate = rate
+        self.burst = burst
+        self.limiter_kwargs = limiter_kwargs
+        self.hosts = {}
+
+    def host(self, url):
+        netloc = urlparse(url).netloc
+        if netloc not in self.hosts:
+            self.hosts[netloc] = HostState(self.rate, self.burst, **self.limiter_kwargs)
+        return self.hosts[netloc]
+
+    def slot(self, url):
+        return Slot(self.host(url))
+
+    def snapshot(self):
+        return {
+            netloc: {
+                'limit': int(host.limiter.limit),
+                'in_flight': host.limiter.in_flight,
+                'tokens': round(host.bucket.tokens, 2),
+                'requests': host.requests,
+                'errors': host.errors,
+                'latency': round(host.latency, 3),
+            }
+            for netloc, host in self.hosts.items()
+        }
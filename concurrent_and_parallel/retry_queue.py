@@ -0,0 +1,82 @@
+import json
+import time
+import random
+import asyncio
+import logging
+
+
+class RetryScheduler(object):
+    """Delayed retries for failed Crawler tasks, backed by a Redis sorted set.
+
+    A failed task gets its attempt count bumped in its own ``tries`` field and
+    is parked in the ``key`` sorted set scored by its next-attempt time, with
+    exponential backoff (``base_delay * 2 ** (tries - 1)``, capped at
+    ``max_delay``) and jitter. ``run`` moves due tasks back to their queue.
+    After ``max_tries`` attempts a task goes to the ``{redis_key}:dead`` set.
+    """
+
+    def __init__(self, redis_client, task_queue, max_tries=4, base_delay=1, max_delay=600, key='retry',
+                 batch_size=100, poll_interval=1):
+        self.redis_client = redis_client
+        self.task_queue = task_queue
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.key = key
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+
+    def delay(self, tries):
+        delay = min(self.max_delay, self.base_delay * 2 ** (tries - 1))
+        # equal jitter: keep half the backoff, randomise the rest so retries do not line up
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def schedule(self, redis_key, task):
+        """Park a failed task for a later attempt, return False if it was dead-lettered instead."""
+        json_data = json.loads(task)
+        json_data['tries'] = json_data.get('tries', 0) + 1
+        if json_data['tries'] >= self.max_tries:
+            await self.redis_client.sadd('{}:dead'.format(redis_key), json.dumps(json_data))
+            logging.warning('{} failed {} times, moved to dead letter'.format(json_data['url'], json_data['tries']))
+            return False
+        member = json.dumps([redis_key, json.dumps(json_data)])
+        await self.redis_client.zadd(self.key, {member: time.time() + self.delay(json_data['tries'])})
+        return True
+
+    async def pop_due(self):
+        members = await self.redis_client.zrangebyscore(self.key, '-inf', time.time(), start=0, num=self.batch_size)
+        if not members:
+            return []
+        # ZREM tells us which members this process claimed when several crawlers poll the same set
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for member in members:
+                pipe.zrem(self.key, member)
+            claimed = await pipe.execute()
+        return [json.loads(member) for member, ok in zip(members, claimed) if ok]
+
+    async def run(self):
+        while True:
+            try:
+                due = await self.pop_due()
+            except Exception as err:
+                logging.warning('poll retries raised {}'.format(str(err)))
+                due = []
+            if due:
+                try:
+                    await self.task_queue.push_many(due)
+                except Exception as err:
+                    logging.warning('push {} retries raised {}'.format(len(due), str(err)))
+                    await self.restore(due)
+                    due = []
+            if len(due) < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    async def restore(self, due):
+        """Put claimed tasks back in the sorted set, due right away, after their push failed."""
+        try:
+            await self.redis_client.zadd(self.key, {json.dumps(item): time.time() for item in due})
+        except Exception as err:
+            logging.error('restore {} retries raised {}, lost: {}'.format(len(due), str(err), due))
+
+    async def qsize(self):
+        return await self.redis_client.zcard(self.key)
@@ -0,0 +1,139 @@
+import time
+import asyncio
+import logging
+from collections import deque, defaultdict
+
+# SPOP a batch and lease every task in the same step, so a crash cannot lose them in between
+LEASE_SCRIPT = """
+local tasks = redis.call('SPOP', KEYS[1], ARGV[1])
+for _, task in ipairs(tasks) do
+    redis.call('ZADD', KEYS[2], ARGV[2], task)
+end
+return tasks
+"""
+
+# move leases past their deadline back to the task set, ZREM first so only one sweeper wins
+RECLAIM_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, task in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], task)
+    redis.call('SADD', KEYS[2], task)
+end
+return #expired
+"""
+
+
+class RedisTaskQueue(object):
+    """Batched, non-blocking view of the Crawler's Redis task sets with leased dequeue.
+
+    ``pop`` serves tasks from a local prefetch buffer per key and refills it
+    with one script call that SPOPs ``batch_size`` tasks and records each in
+    the ``{key}:leases`` sorted set with a deadline ``lease_timeout`` seconds
+    ahead. Finished tasks are ``ack``-ed and removed from the leases in
+    batches by ``run``, which also reclaims expired leases, so the task of a
+    worker that died mid-fetch goes back to its set instead of being lost.
+    ``push`` adds any number of tasks with one SADD and ``push_many``
+    pipelines several keys at once. ``redis_client`` must be a
+    ``redis.asyncio.Redis`` created with ``decode_responses=True``.
+    """
+
+    def __init__(self, redis_client, batch_size=100, lease_timeout=300, sweep_interval=30):
+        self.redis_client = redis_client
+        self.batch_size = batch_size
+        self.lease_timeout = lease_timeout
+        self.sweep_interval = sweep_interval
+        self.buffers = defaultdict(deque)
+        self.locks = defaultdict(asyncio.Lock)
+        self.acks = defaultdict(list)
+        self.lease_script = redis_client.register_script(LEASE_SCRIPT)
+        self.reclaim_script = redis_client.register_script(RECLAIM_SCRIPT)
+
+    @staticmethod
+    def lease_key(redis_key):
+        return '{}:leases'.format(redis_key)
+
+    async def pop(self, redis_key):
+        buffer = self.buffers[redis_key]
+        # a task that sat in the buffer for half its lease may be reclaimed soon, leave it to the sweeper
+        while buffer and buffer[0][1] < time.time() + self.lease_timeout / 2:
+            buffer.popleft()
+        if not buffer:
+            # only one coroutine refills, the others wait and take from the new batch
+            async with self.locks[redis_key]:
+                if not buffer:
+                    await self.fill(redis_key)
+        return buffer.popleft()[0] if buffer else None
+
+    async def fill(self, redis_key):
+        deadline = time.time() + self.lease_timeout
+        tasks = await self.lease_script(keys=[redis_key, self.lease_key(redis_key)],
+                                        args=[self.batch_size, deadline])
+        self.buffers[redis_key].extend((task, deadline) for task in tasks)
+
+    def ack(self, redis_key, task):
+        """Mark a popped task as done; the lease is dropped by the next ``flush_acks``."""
+        self.acks[redis_key].append(task)
+
+    async def flush_acks(self):
+        acks, self.acks = self.acks, defaultdict(list)
+        if not acks:
+            return
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for redis_key, tasks in acks.items():
+                pipe.zrem(self.lease_key(redis_key), *tasks)
+            await pipe.execute()
+
+    async def reclaim(self, redis_key):
+        """Requeue tasks whose lease expired, return how many."""
+        total = 0
+        while True:
+            count = await self.reclaim_script(keys=[self.lease_key(redis_key), redis_key],
+                                              args=[time.time(), self.batch_size])
+            total += count
+            if count < self.batch_size:
+                return total
+
+    async def run(self, redis_keys):
+        """Flush acks every second and reclaim expired leases of ``redis_keys`` every ``sweep_interval``."""
+        swept = 0
+        while True:
+            await asyncio.sleep(1)
+            try:
+                await self.flush_acks()
+                if time.monotonic() - swept >= self.sweep_interval:
+                    swept = time.monotonic()
+                    for redis_key in redis_keys:
+                        count = await self.reclaim(redis_key)
+                        if count:
+                            logging.info('reclaimed {} expired tasks of {}'.format(count, redis_key))
+            except Exception as err:
+                logging.warning('lease sweep raised {}'.format(str(err)))
+
+    async def push(self, redis_key, *tasks):
+        if tasks:
+            await self.redis_client.sadd(redis_key, *tasks)
+
+    async def push_many(self, items):
+        """Push ``(redis_key, task)`` pairs with one pipelined SADD per key."""
+        grouped = defaultdict(list)
+        for redis_key, task in items:
+            grouped[redis_key].append(task)
+        if not grouped:
+            return
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for redis_key, tasks in grouped.items():
+                pipe.sadd(redis_key, *tasks)
+            await pipe.execute()
+
+    def qsize(self, redis_key):
+        return len(self.buffers[redis_key])
+
+    async def close(self):
+        """Flush acks and give prefetched but unprocessed tasks back to Redis."""
+        buffered = [(redis_key, task) for redis_key, buffer in self.buffers.items() for task, _ in buffer]
+        await self.push_many(buffered)
+        for redis_key, task in buffered:
+            self.ack(redis_key, task)
+        await self.flush_acks()
+        self.buffers.clear()
+        await self.redis_client.aclose()
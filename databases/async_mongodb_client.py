@@ -0,0 +1,163 @@
+import asyncio
+import itertools
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .mongodb_client import MongodbClient
+except ImportError:
+    from mongodb_client import MongodbClient
+
+
+class AsyncCursor(object):
+    """``async for`` over a find(); every ``batch_size`` documents cost one executor call."""
+
+    def __init__(self, client, cursor, batch_size):
+        self.client = client
+        self.cursor = cursor.batch_size(batch_size)
+        self.batch_size = batch_size
+        self.buffer = []
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.buffer:
+            self.buffer = await self.client.run(self.next_batch)
+            if not self.buffer:
+                raise StopAsyncIteration
+            self.buffer.reverse()
+        return self.buffer.pop()
+
+    def next_batch(self):
+        return list(itertools.islice(self.cursor, self.batch_size))
+
+    async def to_list(self, length=None):
+        documents = []
+        async for document in self:
+            documents.append(document)
+            if length is not None and len(documents) >= length:
+                break
+        return documents
+
+    async def close(self):
+        await self.client.run(self.cursor.close)
+
+
+class AsyncBulkWriter(object):
+    """Async face of BulkWriter: adding is a local append unless the writer is backed up."""
+
+    def __init__(self, client, writer):
+        self.client = client
+        self.writer = writer
+
+    @property
+    def stats(self):
+        return self.writer.stats
+
+    async def add(self, method, *args, **kwargs):
+        if self.writer.has_room():
+            method(*args, **kwargs)
+        else:
+            # wait for the flush thread off the loop
+            await self.client.run(method, *args, **kwargs)
+
+    async def insert(self, document):
+        await self.add(self.writer.insert, document)
+
+    async def upsert(self, filter_, document):
+        await self.add(self.writer.upsert, filter_, document)
+
+    async def update(self, filter_, update, upsert=False, multi=False):
+        await self.add(self.writer.update, filter_, update, upsert=upsert, multi=multi)
+
+    async def flush(self):
+        await self.client.run(self.writer.flush)
+
+    async def close(self):
+        await self.client.run(self.writer.close)
+
+
+class AsyncCollection(object):
+    def __init__(self, client, collection):
+        self.client = client
+        self.collection = collection
+
+    def find(self, filter_=None, projection=None, batch_size=100, **kwargs):
+        # pymongo does no I/O until the cursor is iterated, so building it on the loop is fine
+        return AsyncCursor(self.client, self.collection.find(filter_, projection, **kwargs), batch_size)
+
+    async def find_one(self, filter_=None, projection=None, **kwargs):
+        return await self.client.run(self.collection.find_one, filter_, projection, **kwargs)
+
+    async def update(self, filter_, update, upsert=False, multi=False):
+        method = self.collection.update_many if multi else self.collection.update_one
+        return await self.client.run(method, filter_, update, upsert=upsert)
+
+    async def insert_many(self, documents, batch_size=1000):
+        """Unordered insert of any iterable, ``batch_size`` documents per round-trip."""
+        documents = iter(documents)
+        inserted = 0
+        while True:
+            batch = list(itertools.islice(documents, batch_size))
+            if not batch:
+                return inserted
+            result = await self.client.run(self.collection.insert_many, batch, ordered=False)
+            inserted += len(result.inserted_ids)
+
+    async def bulk_write(self, requests, ordered=False):
+        return await self.client.run(self.collection.bulk_write, requests, ordered=ordered)
+
+
+class AsyncMongodbClient(object):
+    """asyncio facade over MongodbClient for Crawler-style pipelines.
+
+    Blocking pymongo calls run on a dedicated pool of ``max_workers``
+    threads, so they neither block the event loop nor compete with other
+    users of the loop's default executor.
+    """
+
+    def __init__(self, address='localhost', port=27017, max_workers=8):
+        self.client = MongodbClient(address, port)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mongodb')
+
+    async def run(self, func, *args, **kwargs):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def get_database(self, db_name, user_name=None, password=None):
+        return await self.run(self.client.get_database, db_name, user_name, password)
+
+    def get_collection(self, db, col_name):
+        collection = self.client.get_collection(db, col_name)
+        return AsyncCollection(self, collection) if collection is not None else None
+
+    def bulk_writer(self, collection, **kwargs):
+        return AsyncBulkWriter(self, self.client.bulk_writer(collection.collection, **kwargs))
+
+    async def close(self):
+        await self.run(self.client.close)
+        self.executor.shutdown(wait=False)
+
+
+async def run():
+    mongodb_client = AsyncMongodbClient()
+    db = await mongodb_client.get_database('database_name')
+    col = mongodb_client.get_collection(db, 'collection_name')
+    await col.insert_many({'some_field': i} for i in range(10000))
+    async for document in col.find({'some_field': {'$gt': 100}}, {'_id': 0}, batch_size=500):
+        print(document)
+    await col.update({'some_field': 1}, {'$set': {'other_field': 0}}, multi=True)
+    writer = mongodb_client.bulk_writer(col, max_docs=500)
+    for i in range(10000):
+        await writer.upsert({'some_field': i}, {'some_field': i, 'other_field': -1})
+    await writer.close()
+    print(writer.stats)
+    await mongodb_client.close()
+
+
+def main():
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
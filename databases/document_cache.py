@@ -0,0 +1,176 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+
+
+def cache_key(filter_, projection=None):
+    """Hashable key for a key-based lookup, None if ``filter_`` is not one.
+
+    Only plain equality filters on scalar values (``{'_id': ...}``,
+    ``{'user_id': 1, 'site': 'a'}``) are cached, anything with operators,
+    nested documents or arrays goes straight to the server.
+    """
+    if not isinstance(filter_, dict) or not filter_:
+        return None
+    for field, value in filter_.items():
+        if field.startswith('$') or isinstance(value, (dict, list, tuple)):
+            return None
+    fields = tuple(sorted((field, repr(value)) for field, value in filter_.items()))
+    if projection is None:
+        return fields, None
+    if isinstance(projection, dict):
+        return fields, tuple(sorted((field, repr(value)) for field, value in projection.items()))
+    return fields, tuple(sorted(projection))
+
+
+def document_items(document):
+    return {(field, repr(value)) for field, value in document.items()}
+
+
+class DocumentCache(object):
+    """LRU cache of ``find_one`` results for one collection.
+
+    Holds at most ``max_entries`` documents, each for at most ``ttl`` seconds.
+    Misses (None) are cached too, so hot lookups of absent keys are absorbed
+    as well. ``stats`` counts hits, misses, evictions, expirations and
+    invalidations; ``hit_rate`` is hits over lookups.
+    """
+
+    def __init__(self, max_entries=10000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+        self.__entries = OrderedDict()
+        self.__generation = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @property
+    def generation(self):
+        return self.__generation
+
+    def hit_rate(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def get(self, key):
+        """(True, document) on a hit, (False, None) on a miss."""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self.__entries[key]
+                self.stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return False, None
+            self.__entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return True, copy.deepcopy(entry[1])
+
+    def put(self, key, document, generation):
+        """Store a document read at ``generation``, unless a write invalidated the cache since."""
+        with self.__lock:
+            if generation != self.__generation:
+                return
+            self.__entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(document))
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, documents=(), filter_=None):
+        """Drop every entry a write may have made stale.
+
+        That is entries holding one of the written ``documents``, entries whose
+        filter matches one of them, entries matching a key filter ``filter_``,
+        and every cached miss, since the write may have created a document
+        that now matches it. A ``filter_`` that is not a key filter clears the
+        whole cache.
+        """
+        written = [document_items(document) for document in documents if document]
+        ids = {repr(document['_id']) for document in documents if document and '_id' in document}
+        fields = None
+        if filter_ is not None:
+            key = cache_key(filter_)
+            if key is None:
+                self.clear()
+                return
+            fields = set(key[0])
+        with self.__lock:
+            self.__generation += 1
+            for key, (_, document) in list(self.__entries.items()):
+                if document is None or repr(document.get('_id')) in ids or any(
+                        items.issuperset(key[0]) for items in written) or (
+                        fields is not None and (fields.issubset(key[0]) or
+                                                fields.issubset(document_items(document)))):
+                    del self.__entries[key]
+                    self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__generation += 1
+            self.stats['invalidations'] += len(self.__entries)
+            self.__entries.clear()
+
+
+class CachedCollection(object):
+    """Read-through cache in front of a collection, returned by ``MongodbClient.get_collection(..., cache=...)``.
+
+    Key-based ``find_one`` calls are answered from the DocumentCache; the
+    writes below invalidate what they touch. Writes made through any other
+    method, or by other processes, are only picked up when the entry expires.
+    """
+
+    def __init__(self, collection, cache):
+        self.collection = collection
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def __getitem__(self, name):
+        return self.collection[name]
+
+    def find_one(self, filter_=None, projection=None, *args, **kwargs):
+        key = cache_key(filter_, projection) if not args and not kwargs else None
+        if key is None:
+            return self.collection.find_one(filter_, projection, *args, **kwargs)
+        hit, document = self.cache.get(key)
+        if hit:
+            return document
+        generation = self.cache.generation
+        document = self.collection.find_one(filter_, projection)
+        self.cache.put(key, document, generation)
+        return document
+
+    def find_one_and_update(self, filter_, update, *args, **kwargs):
+        document = self.collection.find_one_and_update(filter_, update, *args, **kwargs)
+        self.invalidate(filter_, document)
+        return document
+
+    def find_one_and_replace(self, filter_, replacement, *args, **kwargs):
+        document = self.collection.find_one_and_replace(filter_, replacement, *args, **kwargs)
+        self.invalidate(filter_, document)
+        return document
+
+    def find_one_and_delete(self, filter_, *args, **kwargs):
+        document = self.collection.find_one_and_delete(filter_, *args, **kwargs)
+        self.invalidate(filter_, document)
+        return document
+
+    def invalidate(self, filter_, document):
+        if document is not None and '_id' in document:
+            self.cache.invalidate([document])
+        else:
+            # nothing matched (or _id was projected out): fall back to the filter
+            self.cache.invalidate(filter_=filter_)
+
+    def update(self, filter_, update, upsert=False, multi=False):
+        method = self.collection.update_many if multi else self.collection.update_one
+        result = method(filter_, update, upsert=upsert)
+        self.cache.invalidate(filter_=filter_)
+        return result
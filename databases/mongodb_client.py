@@ -1,29 +1,257 @@
+import os
+import time
+import atexit
+import logging
+import threading
+
+import bson
 import pymongo
+from pymongo import InsertOne, ReplaceOne, UpdateOne, UpdateMany
+from pymongo.errors import BulkWriteError
+
+try:
+    from .query_profiler import QueryProfiler, ProfiledCollection
+    from .document_cache import DocumentCache, CachedCollection
+except ImportError:
+    from query_profiler import QueryProfiler, ProfiledCollection
+    from document_cache import DocumentCache, CachedCollection
+
+
+class BulkWriter(object):
+    """Buffers writes to one collection and sends them as unordered ``bulk_write`` batches.
+
+    A batch is flushed by a background thread as soon as it holds
+    ``max_docs`` operations or ``max_bytes`` of BSON, or ``flush_interval``
+    seconds after the previous flush; a batch never exceeds either limit and
+    the rest stays buffered for the next one. Callers only block when two
+    full batches are already waiting. ``stats`` holds per-flush latency and the
+    operation/error counts; ``close`` (or leaving the ``with`` block) flushes
+    what is left.
+    """
+
+    def __init__(self, collection, max_docs=1000, max_bytes=8 * 1024 * 1024, flush_interval=1.0):
+        self.collection = collection
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.stats = {'flushes': 0, 'operations': 0, 'errors': 0, 'write_errors': 0,
+                      'last_latency': 0.0, 'total_latency': 0.0}
+        self.__ops = []
+        self.__bytes = 0
+        self.__flushing = 0
+        self.__flush_now = False
+        self.__closed = False
+        self.__condition = threading.Condition()
+        self.__thread = threading.Thread(target=self.__run, name='bulk-writer-{}'.format(collection.name),
+                                         daemon=True)
+        self.__thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def insert(self, document):
+        self.__add(InsertOne(document), document)
+
+    def upsert(self, filter_, document):
+        self.__add(ReplaceOne(filter_, document, upsert=True), document)
+
+    def update(self, filter_, update, upsert=False, multi=False):
+        op = UpdateMany(filter_, update, upsert=upsert) if multi else UpdateOne(filter_, update, upsert=upsert)
+        self.__add(op, update)
+
+    def __add(self, op, document):
+        # wrapped, so pipeline updates (a list of stages) can be measured as well
+        size = len(bson.encode({'d': document}))
+        with self.__condition:
+            if self.__closed:
+                raise RuntimeError('BulkWriter is closed')
+            self.__condition.wait_for(self.has_room)
+            self.__ops.append((op, size))
+            self.__bytes += size
+            if self.__full():
+                self.__condition.notify_all()
+
+    def has_room(self):
+        """True if adding an operation now would not block."""
+        return len(self.__ops) < 2 * self.max_docs
+
+    def __full(self):
+        return len(self.__ops) >= self.max_docs or self.__bytes >= self.max_bytes
+
+    def __due(self, last_flush):
+        return bool(self.__ops) and (self.__closed or self.__flush_now or self.__full() or
+                                     time.monotonic() - last_flush >= self.flush_interval)
+
+    def __run(self):
+        last_flush = time.monotonic()
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__due(last_flush) or (self.__closed and not self.__ops),
+                                          timeout=self.flush_interval)
+                if not self.__due(last_flush):
+                    if self.__closed and not self.__ops:
+                        return
+                    continue
+                ops = self.__take()
+                if not self.__ops:
+                    self.__flush_now = False
+                self.__flushing += 1
+                self.__condition.notify_all()
+            try:
+                self.__flush(ops)
+            finally:
+                last_flush = time.monotonic()
+                with self.__condition:
+                    self.__flushing -= 1
+                    self.__condition.notify_all()
+
+    def __take(self):
+        """Pop the next batch: at most ``max_docs`` operations and ``max_bytes`` (but at least one op)."""
+        count, size = 0, 0
+        for _, op_size in self.__ops:
+            if count >= self.max_docs or (count and size + op_size > self.max_bytes):
+                break
+            count += 1
+            size += op_size
+        ops, self.__ops = [op for op, _ in self.__ops[:count]], self.__ops[count:]
+        self.__bytes -= size
+        return ops
+
+    def __flush(self, ops):
+        start = time.monotonic()
+        try:
+            self.collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as err:
+            self.stats['write_errors'] += len(err.details.get('writeErrors', []))
+            logging.warning('bulk write to {}: {} write errors'.format(self.collection.name,
+                                                                       len(err.details.get('writeErrors', []))))
+        except Exception as err:
+            self.stats['errors'] += 1
+            logging.warning('bulk write to {} raised {}'.format(self.collection.name, str(err)))
+        latency = time.monotonic() - start
+        self.stats['flushes'] += 1
+        self.stats['operations'] += len(ops)
+        self.stats['last_latency'] = latency
+        self.stats['total_latency'] += latency
+
+    def flush(self):
+        """Block until everything buffered so far has been written."""
+        with self.__condition:
+            self.__flush_now = True
+            self.__condition.notify_all()
+            self.__condition.wait_for(lambda: not self.__ops and not self.__flushing)
+
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+        self.__thread.join()
+
+
+class ClientRegistry(object):
+    """Process-local pool of shared ``pymongo.MongoClient`` instances.
+
+    A client is opened once per address, port, credentials and options, and
+    handed to every MongodbClient asking for the same combination. Clients
+    live until exit, even while no MongodbClient uses them, so per-task
+    MongodbClients keep reusing one pool; ``close_all`` runs at exit. pymongo
+    clients must not be shared across ``fork()``: the child forgets the
+    parent's clients and opens its own on first use.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # the child must not touch the parent's sockets, so drop the clients without closing them
+        self.pid = os.getpid()
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, address, port, **options):
+        if self.pid != os.getpid():
+            self.reset()
+        key = (address, port, tuple(sorted(options.items())))
+        with self.lock:
+            if key not in self.clients:
+                self.clients[key] = pymongo.MongoClient(address, port, **options)
+            return self.clients[key]
+
+    def close_all(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                for client in self.clients.values():
+                    client.close()
+            self.clients.clear()
+
+
+REGISTRY = ClientRegistry()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=REGISTRY.reset)
+atexit.register(REGISTRY.close_all)
 
 
 class MongodbClient(object):
-    def __init__(self, address='localhost', port=27017):
-        self.__client = pymongo.MongoClient(address, port)
+    """Handle on a shared MongoClient from REGISTRY.
+
+    Sockets are opened lazily (``connect=False``), so a MongodbClient built
+    before a fork is safe to use in the child. ``get_database`` with
+    credentials authenticates once per database and user, through a
+    client authenticated against that database, and reuses it afterwards.
+    """
+
+    def __init__(self, address='localhost', port=27017, max_pool_size=50, min_pool_size=0,
+                 max_idle_time_ms=60000, wait_queue_timeout_ms=10000, **options):
+        self.address = address
+        self.port = port
+        self.options = dict(options, maxPoolSize=max_pool_size, minPoolSize=min_pool_size,
+                            maxIdleTimeMS=max_idle_time_ms, waitQueueTimeoutMS=wait_queue_timeout_ms)
+        self.options.setdefault('connect', False)
+        self.__pid = None
+        self.__clients = {}
+
+    def __acquire(self, db_name=None, user_name=None, password=None):
+        if self.__pid != os.getpid():
+            # first use, or first use after a fork: the handles of the parent are gone
+            self.__pid = os.getpid()
+            self.__clients = {}
+        if (db_name, user_name) not in self.__clients:
+            options = dict(self.options)
+            if user_name is not None:
+                options.update(username=user_name, password=password, authSource=db_name)
+            self.__clients[(db_name, user_name)] = REGISTRY.acquire(self.address, self.port, **options)
+        return self.__clients[(db_name, user_name)]
 
     def get_client(self):
-        return self.__client
+        return self.__acquire()
 
     def close(self):
-        client = self.get_client()
-        if client is not None:
-            client.close()
+        """Drop this handle's clients; the shared MongoClients stay open for other handles until exit."""
+        self.__clients = {}
 
     def get_database(self, db_name, user_name=None, password=None):
         if user_name is not None:
-            self.__client[db_name].authenticate(user_name, password)
-        return self.__client[db_name]
+            return self.__acquire(db_name, user_name, password)[db_name]
+        return self.get_client()[db_name]
 
-    def get_collection(self, db, col_name):
+    def get_collection(self, db, col_name, profiler=None, cache=None):
         collect = None
         if db is not None:
             collect = db[col_name]
+            if profiler is not None:
+                # opt-in: time every find and sample explain() into the QueryProfiler
+                collect = ProfiledCollection(collect, profiler)
+            if cache is not None:
+                # opt-in: key-based find_one served from a per-collection DocumentCache
+                collect = CachedCollection(collect, cache)
         return collect
 
+    def bulk_writer(self, collection, **kwargs):
+        return BulkWriter(collection, **kwargs)
+
     def get_collection_names(self, db_name):
         db = self.get_database(db_name)
         names = []
@@ -32,7 +260,7 @@ class MongodbClient(object):
         return names
 
     def clear_collection(self, db_name, collect):
-        db = self.__client[db_name]
+        db = self.get_client()[db_name]
         if db is not None:
             db[collect].remove()
 
@@ -66,6 +294,18 @@ def main():
     res = col.find_one_and_replace({'some_field': 'value'}, {'other_field': 1})
     res = col.find_one_and_delete({'some_field': 'value'})
     pprint.pprint(res)
+    # profile queries, explain 10% of them and print the slow shapes with index suggestions
+    profiler = QueryProfiler(sample_rate=0.1)
+    col = mongodb_client.get_collection(db, 'collection_name', profiler=profiler)
+    res = list(col.find({'some_field': 'value', 'other_field': {'$gt': 0}}).sort('user_id', -1))
+    profiler.dump('query_profile.json')  # python query_profiler.py report query_profile.json
+    print(profiler.report())
+    # cache hot key lookups, at most 1000 documents for 30 seconds
+    col = mongodb_client.get_collection(db, 'collection_name', cache=DocumentCache(max_entries=1000, ttl=30))
+    for _ in range(1000):
+        res = col.find_one({'user_id': 1})
+    res = col.find_one_and_update({'user_id': 1}, {'$set': {'other_field': 2}})  # invalidates the cached document
+    print(col.cache.stats, col.cache.hit_rate())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,152 @@
+import time
+import asyncio
+import logging
+import argparse
+
+import aiohttp
+from redis import asyncio as aioredis
+
+PENDING_KEY = 'proxies:pending'
+RANKED_KEY = 'proxies:ranked'
+# same members as RANKED_KEY, scored by the unix time in ms at which the harvester's key expires
+EXPIRY_KEY = 'proxies:expiry'
+
+# drop at most ARGV[2] members whose harvester key expired before ARGV[1] from both sorted sets
+PRUNE = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, proxy in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], proxy)
+    redis.call('ZREM', KEYS[2], proxy)
+end
+"""
+DROP_EXPIRED_SCRIPT = PRUNE + "return #expired"
+FASTEST_SCRIPT = PRUNE + "return redis.call('ZRANGE', KEYS[1], 0, ARGV[3])"
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+async def fastest(redis_client, count=10):
+    """The ``count`` healthy, unexpired proxies with the lowest measured latency."""
+    if count <= 0:
+        return []
+    script = redis_client.register_script(FASTEST_SCRIPT)
+    return await script(keys=[RANKED_KEY, EXPIRY_KEY], args=[now_ms(), 1000, count - 1])
+
+
+async def drop_expired(redis_client, limit=1000):
+    script = redis_client.register_script(DROP_EXPIRED_SCRIPT)
+    return await script(keys=[RANKED_KEY, EXPIRY_KEY], args=[now_ms(), limit])
+
+
+class ProxyValidator(object):
+    """Probes harvested proxies and keeps a latency-ranked index of the ones that work.
+
+    The harvester adds every new proxy to ``proxies:pending``; ``run`` takes
+    them in batches, probes ``target`` through each one with at most
+    ``concurrency`` probes in flight, and stores the latency of working
+    proxies as their score in the ``proxies:ranked`` sorted set. The PTTL of
+    each proxy's harvester key goes to ``proxies:expiry``; ``run`` drops
+    members as soon as their key expires and ``fastest`` never returns them.
+    Every ``revalidate_interval`` seconds the ranked proxies are probed again
+    and their expiry refreshed, so a proxy that stops working leaves the index
+    as well.
+    """
+
+    def __init__(self, redis_client, target='http://httpbin.org/get', concurrency=100, timeout=5, batch_size=500,
+                 revalidate_interval=60):
+        self.redis_client = redis_client
+        self.target = target
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.revalidate_interval = revalidate_interval
+        self.semaphore = None
+        self.session = None
+
+    async def probe(self, proxy):
+        """Latency of one request to ``target`` through ``proxy``, None if it failed."""
+        async with self.semaphore:
+            start = time.monotonic()
+            try:
+                async with self.session.get(self.target, proxy=proxy) as response:
+                    await response.read()
+                    if response.status != 200:
+                        return None
+            except Exception:
+                return None
+            return time.monotonic() - start
+
+    async def validate(self, proxies):
+        if not proxies:
+            return 0, 0
+        latencies = await asyncio.gather(*[self.probe(proxy) for proxy in proxies])
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for proxy in proxies:
+                pipe.pttl(proxy)
+            ttls = await pipe.execute()
+        now = now_ms()
+        healthy, expiry, dead = {}, {}, []
+        for proxy, latency, ttl in zip(proxies, latencies, ttls):
+            # -2: the harvester key is gone, -1: it has no TTL
+            if latency is None or ttl == -2:
+                dead.append(proxy)
+            else:
+                healthy[proxy] = latency
+                expiry[proxy] = now + ttl if ttl >= 0 else float('inf')
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            if healthy:
+                pipe.zadd(RANKED_KEY, healthy)
+                pipe.zadd(EXPIRY_KEY, expiry)
+            if dead:
+                pipe.zrem(RANKED_KEY, *dead)
+                pipe.zrem(EXPIRY_KEY, *dead)
+            await pipe.execute()
+        return len(healthy), len(dead)
+
+    async def validate_pending(self):
+        total = 0
+        while True:
+            proxies = await self.redis_client.spop(PENDING_KEY, self.batch_size)
+            if not proxies:
+                return total
+            healthy, dead = await self.validate(proxies)
+            total += healthy + dead
+            logging.info('validated {} new proxies: {} healthy, {} dead'.format(len(proxies), healthy, dead))
+
+    async def revalidate(self):
+        cursor = 0
+        while True:
+            cursor, members = await self.redis_client.zscan(RANKED_KEY, cursor, count=self.batch_size)
+            await self.validate([proxy for proxy, _ in members])
+            if cursor == 0:
+                return
+
+    async def run(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, force_close=True)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as self.session:
+            revalidated = time.monotonic()
+            while True:
+                await drop_expired(self.redis_client)
+                if not await self.validate_pending():
+                    await asyncio.sleep(1)
+                if time.monotonic() - revalidated >= self.revalidate_interval:
+                    await self.revalidate()
+                    revalidated = time.monotonic()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='validate harvested proxies')
+    parser.add_argument('--target', default='http://httpbin.org/get', help='url probed through every proxy')
+    parser.add_argument('--concurrency', type=int, default=100)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    redis_client = aioredis.Redis(host='localhost', port=6379, decode_responses=True)
+    asyncio.run(ProxyValidator(redis_client, target=args.target, concurrency=args.concurrency).run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import functools
+from collections.abc import Mapping
+from collections import Counter
+
+RANGE_OPERATORS = ('$gt', '$gte', '$lt', '$lte', '$ne', '$nin', '$exists', '$regex', '$not')
+
+
+def query_shape(value):
+    """The filter with every literal replaced by its type, so equal-shaped queries group together."""
+    if isinstance(value, dict):
+        shape = {}
+        for key, item in value.items():
+            if key == '$regex':
+                pattern = getattr(item, 'pattern', item)
+                shape[key] = 'anchored' if isinstance(pattern, str) and pattern.startswith('^') else 'unanchored'
+            elif key in ('$in', '$nin'):
+                shape[key] = 'list'
+            else:
+                shape[key] = query_shape(item)
+        return shape
+    if isinstance(value, (list, tuple)):
+        return [query_shape(item) for item in value]
+    return type(value).__name__
+
+
+def plan_stages(plan):
+    """Every stage name in a winning plan tree, root first."""
+    stages = []
+    while plan:
+        plan = plan.get('queryPlan', plan)
+        stages.append(plan.get('stage'))
+        for child in plan.get('inputStages', []):
+            stages.extend(plan_stages(child))
+        plan = plan.get('inputStage')
+    return stages
+
+
+def suggest_index(filter_, sort=None):
+    """Compound index following the equality, sort, range rule, or None if nothing to index."""
+    equality, ranges = [], []
+    clauses = [filter_ or {}]
+    while clauses:
+        clause = clauses.pop(0)
+        for field, value in clause.items():
+            if field == '$and':
+                clauses.extend(value)
+            elif field.startswith('$'):
+                continue
+            elif isinstance(value, dict) and any(op in value for op in RANGE_OPERATORS):
+                ranges.append(field)
+            else:
+                equality.append(field)
+    keys = [(field, 1) for field in equality]
+    keys.extend((field, direction) for field, direction in (sort or []) if field not in equality)
+    keys.extend((field, 1) for field in ranges if field not in dict(keys))
+    return keys or None
+
+
+class QueryProfiler(object):
+    """Aggregates latency and sampled ``explain()`` output per query shape.
+
+    Every query through a ProfiledCollection is timed; ``sample_rate`` of
+    them are also explained. A shape is flagged when its plan does a
+    COLLSCAN, sorts in memory, or examines ``scan_ratio`` times more
+    documents than it returns, and gets a suggested compound index.
+    """
+
+    def __init__(self, sample_rate=0.1, scan_ratio=10):
+        self.sample_rate = sample_rate
+        self.scan_ratio = scan_ratio
+        self.shapes = {}
+        self.__lock = threading.Lock()
+
+    def shape_stats(self, collection, filter_, sort):
+        key = json.dumps([collection, query_shape(filter_ or {}), sort or []], sort_keys=True)
+        if key not in self.shapes:
+            self.shapes[key] = {
+                'collection': collection, 'filter': query_shape(filter_ or {}), 'sort': sort or [],
+                'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'sampled': 0, 'docs_examined': 0, 'keys_examined': 0,
+                'returned': 0, 'plans': Counter(), 'flags': set(),
+                'suggested_index': suggest_index(filter_, sort),
+            }
+        return self.shapes[key]
+
+    def should_explain(self):
+        return random.random() < self.sample_rate
+
+    def record(self, collection, filter_, sort, elapsed_ms, explain=None):
+        with self.__lock:
+            stats = self.shape_stats(collection, filter_, sort)
+            stats['count'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            if explain is None:
+                return
+            stats['sampled'] += 1
+            stages = plan_stages(explain.get('queryPlanner', {}).get('winningPlan', {}))
+            stats['plans'][' <- '.join(str(stage) for stage in stages)] += 1
+            execution = explain.get('executionStats', {})
+            stats['docs_examined'] += execution.get('totalDocsExamined', 0)
+            stats['keys_examined'] += execution.get('totalKeysExamined', 0)
+            stats['returned'] += execution.get('nReturned', 0)
+            if 'COLLSCAN' in stages:
+                stats['flags'].add('COLLSCAN')
+            if 'SORT' in stages:
+                stats['flags'].add('in-memory sort')
+            if execution.get('totalDocsExamined', 0) > self.scan_ratio * max(1, execution.get('nReturned', 0)):
+                stats['flags'].add('examined/returned > {}'.format(self.scan_ratio))
+
+    def to_json(self):
+        with self.__lock:
+            return [dict(stats, plans=dict(stats['plans']), flags=sorted(stats['flags']))
+                    for stats in self.shapes.values()]
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_json(), f, indent=2)
+
+    def report(self):
+        return format_report(self.to_json())
+
+
+def format_report(shapes):
+    lines = []
+    for stats in sorted(shapes, key=lambda s: s['total_ms'], reverse=True):
+        lines.append('{collection} filter={filter} sort={sort}'.format(
+            collection=stats['collection'], filter=json.dumps(stats['filter'], sort_keys=True), sort=stats['sort']))
+        lines.append('    count={} avg={:.1f}ms max={:.1f}ms sampled={} examined={} returned={}'.format(
+            stats['count'], stats['total_ms'] / max(1, stats['count']), stats['max_ms'], stats['sampled'],
+            stats['docs_examined'], stats['returned']))
+        for plan, count in stats['plans'].items():
+            lines.append('    plan {} x{}'.format(plan, count))
+        if stats['flags']:
+            lines.append('    FLAGS: {}'.format(', '.join(stats['flags'])))
+            if stats['suggested_index']:
+                lines.append('    suggest: create_index({})'.format(
+                    [tuple(key) for key in stats['suggested_index']]))
+    return '\n'.join(lines)
+
+
+class ProfiledCursor(object):
+    """Wraps a pymongo Cursor; records the query when iteration finishes.
+
+    Chained cursor methods (``limit``, ``hint``, ``max_time_ms`` ...) return
+    the wrapper, so the query stays profiled. Profiling errors are logged,
+    never raised into the query.
+    """
+
+    def __init__(self, profiler, collection, cursor, filter_):
+        self.profiler = profiler
+        self.collection = collection
+        self.cursor = cursor
+        self.filter = filter_
+        self.sort_keys = None
+        self.iterator = None
+
+    def __getattr__(self, name):
+        attr = getattr(self.cursor, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def chained(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return self if result is self.cursor else result
+
+        return chained
+
+    def sort(self, key_or_list, direction=None):
+        if isinstance(key_or_list, str):
+            self.sort_keys = [[key_or_list, direction or 1]]
+        elif isinstance(key_or_list, dict):
+            self.sort_keys = [list(item) for item in key_or_list.items()]
+        else:
+            self.sort_keys = [list(item) for item in key_or_list]
+        if direction is None:
+            self.cursor.sort(key_or_list)
+        else:
+            self.cursor.sort(key_or_list, direction)
+        return self
+
+    def explain_sample(self):
+        if not self.profiler.should_explain():
+            return None
+        try:
+            return self.cursor.clone().explain()
+        except Exception as err:
+            logging.warning('explain on {} raised {}'.format(self.collection.name, str(err)))
+            return None
+
+    def __iter__(self):
+        explain = self.explain_sample()
+        start = time.monotonic()
+        try:
+            yield from self.cursor
+        finally:
+            try:
+                self.profiler.record(self.collection.name, self.filter, self.sort_keys,
+                                     (time.monotonic() - start) * 1000, explain)
+            except Exception as err:
+                logging.warning('profiling query on {} raised {}'.format(self.collection.name, str(err)))
+
+    def __next__(self):
+        if self.iterator is None:
+            self.iterator = iter(self)
+        return next(self.iterator)
+
+    next = __next__
+
+
+class ProfiledCollection(object):
+    """Opt-in profiling wrapper returned by ``MongodbClient.get_collection(..., profiler=...)``."""
+
+    def __init__(self, collection, profiler):
+        self.collection = collection
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def __getitem__(self, name):
+        return self.collection[name]
+
+    def find(self, filter_=None, *args, **kwargs):
+        return ProfiledCursor(self.profiler, self.collection, self.collection.find(filter_, *args, **kwargs), filter_)
+
+    def find_one(self, filter_=None, *args, **kwargs):
+        if filter_ is not None and not isinstance(filter_, Mapping):
+            # like pymongo: find_one(some_id) looks the document up by _id
+            filter_ = {'_id': filter_}
+        for document in self.find(filter_, *args, **kwargs).limit(-1):
+            return document
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='mongodb query profiler')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    report = subparsers.add_parser('report', help='print the report of a profile dumped by QueryProfiler.dump')
+    report.add_argument('path')
+    args = parser.parse_args()
+    if args.command == 'report':
+        with open(args.path) as f:
+            print(format_report(json.load(f)))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,46 +1,107 @@
 import time
 import queue
 import json
+import threading
 from concurrent.futures import ThreadPoolExecutor
 
 import redis
 import requests
 
 from local_config import proxies_urls
+from proxy_validator import PENDING_KEY
 
+# one pool for every harvester thread instead of a client (and its sockets) per thread
+POOL = redis.ConnectionPool(host='localhost', port=6379, decode_responses=True)
 
-def insert_redis(redis_client, ip, ttl):
+
+class IngestStats(object):
+    def __init__(self):
+        self.started = time.time()
+        self.batches = 0
+        self.proxies = 0
+        self.failures = 0
+        self.__lock = threading.Lock()
+
+    def record(self, count, ok):
+        with self.__lock:
+            if ok:
+                self.batches += 1
+                self.proxies += count
+            else:
+                self.failures += 1
+
+    def report(self):
+        elapsed = time.time() - self.started
+        return 'batches: {}, proxies: {}, failures: {}, rate: {:.1f} proxies/s'.format(
+            self.batches, self.proxies, self.failures, self.proxies / elapsed if elapsed else 0)
+
+
+STATS = IngestStats()
+
+
+def parse_proxies(ips):
+    """``(ip, ttl)`` pairs with a positive integer ttl; malformed lines are reported and skipped."""
+    proxies = []
+    for line in ips:
+        try:
+            ip, ttl = line
+            ip, ttl = ip.strip(), int(ttl)
+            if not ip or ttl <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            print('skipping malformed proxy line {!r}'.format(line))
+            continue
+        proxies.append((ip, ttl))
+    return proxies
+
+
+def insert_redis(redis_client, ips, retry=3, backoff=0.5):
+    """Write a batch of ``(ip, ttl)`` in one pipelined transaction, each key with its own PX TTL."""
     key = 'http://{}'
-    retry = 3
+    proxies = parse_proxies(ips)
+    if not proxies:
+        return False
 
     while retry > 0:
         try:
-            redis_client.set(name=key.format(ip), value=key.format(ip), px=ttl)
-        except Exception as err:
+            with redis_client.pipeline(transaction=True) as pipe:
+                for ip, ttl in proxies:
+                    pipe.set(name=key.format(ip), value=key.format(ip), px=ttl)
+                # queued for proxy_validator.py, which ranks the working ones by latency
+                pipe.sadd(PENDING_KEY, *[key.format(ip) for ip, _ in proxies])
+                pipe.execute()
+        except redis.RedisError as err:
             print(str(err))
+            retry -= 1
+            if retry > 0:
+                time.sleep(backoff)
+                backoff *= 2
             continue
         else:
+            STATS.record(len(proxies), True)
             return True
     else:
+        STATS.record(len(proxies), False)
         return False
 
 
 def get_proxies(url):
-    redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
+    redis_client = redis.Redis(connection_pool=POOL)
     while True:
         try:
             r = requests.get(url, timeout=10)
         except Exception as err:
             print(str(err))
+            time.sleep(10)
             continue
         if r.status_code == 200:
             if 'msg' in r.text:
                 print('{} {}'.format(url, json.loads(r.text)['msg']))
                 break
-            ips = r.text.strip('\n').split('\n')
-            for ip in ips:
-                if not insert_redis(redis_client, *ip.split(',')):
-                    break
+            ips = [ip.split(',') for ip in r.text.strip('\n').split('\n')]
+            # a batch that still fails after the retries is dropped, the next fetch brings fresh proxies
+            insert_redis(redis_client, ips)
+            print(STATS.report())
 
         time.sleep(10)
     else:
@@ -0,0 +1,119 @@
+import asyncio
+from functools import wraps
+
+import aiohttp
+
+try:
+    from .requests_client import for_all_methods
+except ImportError:
+    from requests_client import for_all_methods
+
+
+def check_status(func):
+    @wraps(func)
+    async def decorator(*args, method, url, **kwargs):
+        if method.upper() not in ('GET', 'POST'):
+            raise NotImplementedError('only GET or POST support!')
+        return await func(*args, method=method, url=url, **kwargs)
+
+    return decorator
+
+
+@for_all_methods(check_status)
+class AiohttpClient(object):
+    """asyncio counterpart of RequestsClient.
+
+    All requests go through one ClientSession so they share a single
+    TCPConnector (and its keep-alive pool); ``limit``/``limit_per_host`` size
+    that pool. Use it as an async context manager or call ``close()``.
+    """
+
+    def __init__(self, limit=100, limit_per_host=0, timeout=30, **session_kwargs):
+        self.connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host)
+        self.session = aiohttp.ClientSession(connector=self.connector,
+                                             timeout=aiohttp.ClientTimeout(total=timeout),
+                                             **session_kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self.session.close()
+
+    async def response_json(self, *_, method, url, **kwargs):
+        async with self.session.request(method, url, **kwargs) as response:
+            return await response.json(content_type=None)
+
+    async def response_content(self, *_, method, url, **kwargs):
+        async with self.session.request(method, url, **kwargs) as response:
+            return await response.read()
+
+    async def response_text(self, *_, method, url, **kwargs):
+        async with self.session.request(method, url, **kwargs) as response:
+            return await response.text()
+
+    async def fetch_many(self, requests, concurrency=10, type_='json'):
+        """Run ``requests`` with at most ``concurrency`` in flight.
+
+        ``requests`` is an iterable of kwargs dicts for the ``response_*``
+        methods (``method``, ``url``, ``params`` ...). Yields
+        ``(index, result)`` as soon as each request finishes, so the order is
+        completion order, not input order. A failed request yields the
+        exception as its result instead of aborting the whole batch.
+        """
+        fetch = getattr(self, 'response_{}'.format(type_))
+        requests = iter(enumerate(requests))
+        pending = set()
+
+        async def run(index, kwargs):
+            try:
+                return index, await fetch(**kwargs)
+            except Exception as err:
+                return index, err
+
+        # keep the window full instead of creating every task up front, so a
+        # million-entry generator does not turn into a million pending tasks
+        for index, kwargs in requests:
+            pending.add(asyncio.ensure_future(run(index, kwargs)))
+            if len(pending) >= concurrency:
+                break
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                for index, kwargs in requests:
+                    pending.add(asyncio.ensure_future(run(index, kwargs)))
+                    if len(pending) >= concurrency:
+                        break
+        finally:
+            # the consumer stopped early (break, exception, aclose): do not leave requests running
+            for future in pending:
+                future.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+
+async def run():
+    async with AiohttpClient() as client:
+        # get
+        print(await client.response_json(method='get', url='https://httpbin.org/get', params={'params': 'params'}))
+        print(await client.response_content(method='get', url='https://httpbin.org/get', params={'params': 'params'}))
+        # post
+        print(await client.response_text(method='post', url='https://httpbin.org/post',
+                                         params={'params': 'params'}, data={'form_data': 'form_data'}))
+        # bulk
+        requests = ({'method': 'get', 'url': 'https://httpbin.org/get', 'params': {'a': i}} for i in range(20))
+        async for index, result in client.fetch_many(requests, concurrency=5):
+            print(index, result)
+
+
+def main():
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+import os
+import time
+import json
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CACHEABLE_STATUS = (200, 203, 300, 301, 404, 410)
+
+
+class CacheEntry(object):
+    def __init__(self, response, ttl):
+        self.status_code = response.status_code
+        self.headers = CaseInsensitiveDict(response.headers)
+        self.content = response.content
+        self.encoding = response.encoding
+        self.url = response.url
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        self.refresh(ttl)
+
+    def refresh(self, ttl):
+        self.expires = time.time() + ttl
+
+    def is_fresh(self):
+        return time.time() < self.expires
+
+    def has_validators(self):
+        return self.etag is not None or self.last_modified is not None
+
+    def size(self):
+        return len(self.content)
+
+    def to_response(self):
+        response = requests.Response()
+        response.status_code = self.status_code
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.content
+        response.encoding = self.encoding
+        response.url = self.url
+        return response
+
+
+class MemoryStore(object):
+    """LRU bounded by both entry count and total body bytes."""
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                self.__entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        """False if ``entry`` alone is over ``max_bytes``; the old entry for ``key`` is dropped either way."""
+        with self.__lock:
+            self.__pop(key)
+            if entry.size() > self.max_bytes:
+                return False
+            self.__entries[key] = entry
+            self.bytes += entry.size()
+            while len(self.__entries) > self.max_entries or self.bytes > self.max_bytes:
+                self.__pop(next(iter(self.__entries)))
+            return True
+
+    def delete(self, key):
+        with self.__lock:
+            self.__pop(key)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.bytes = 0
+
+    def __pop(self, key):
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size()
+
+
+class DiskStore(object):
+    """One pickle file per key; the oldest files are pruned past ``max_entries``."""
+
+    def __init__(self, directory, max_entries=100000):
+        self.directory = directory
+        self.max_entries = max_entries
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.__count = len(os.listdir(directory))
+        self.__lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            self.delete(key)
+            return None
+
+    def set(self, key, entry):
+        path = self._path(key)
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+        existed = os.path.exists(path)
+        os.replace(tmp_path, path)
+        with self.__lock:
+            if not existed:
+                self.__count += 1
+            if self.__count > self.max_entries:
+                self.__prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            return
+        with self.__lock:
+            self.__count -= 1
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        with self.__lock:
+            self.__count = 0
+
+    def __prune(self):
+        # drop the oldest 10% in one go so we do not rescan the directory on every write
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)]
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:max(1, len(paths) // 10)]:
+            os.remove(path)
+        self.__count = len(paths) - max(1, len(paths) // 10)
+
+
+class HttpCache(object):
+    """Opt-in response cache for RequestsClient.
+
+    Entries are keyed on method, URL, params and body. Freshness comes from
+    Cache-Control (``max-age``/``s-maxage``, ``no-cache``, ``no-store``) or
+    Expires, falling back to ``default_ttl``. Stale entries that carry an ETag
+    or Last-Modified are revalidated with a conditional request and served
+    from the cache on 304. ``disk_dir`` adds a persistent store behind the
+    in-memory LRU.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, default_ttl=0, disk_dir=None,
+                 methods=('GET',)):
+        self.memory = MemoryStore(max_entries, max_bytes)
+        self.disk = DiskStore(disk_dir) if disk_dir is not None else None
+        self.default_ttl = default_ttl
+        self.methods = tuple(m.upper() for m in methods)
+        self.stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'stored': 0, 'bytes_served': 0,
+                      'bytes_fetched': 0}
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def key(method, url, params=None, data=None, json_=None):
+        body = data if isinstance(data, (bytes, str)) else json.dumps(data, sort_keys=True, default=str)
+        if isinstance(params, dict):
+            params = sorted(params.items())
+        raw = json.dumps([method.upper(), url, params, body,
+                          json.dumps(json_, sort_keys=True, default=str)], default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def request(self, session, method, url, **kwargs):
+        if method.upper() not in self.methods:
+            return session.request(method, url, **kwargs)
+        key = self.key(method, url, kwargs.get('params'), kwargs.get('data'), kwargs.get('json'))
+        entry = self.get(key)
+        if entry is not None and entry.is_fresh():
+            self.__count(hits=1, bytes_served=entry.size())
+            return entry.to_response()
+
+        if entry is not None and entry.has_validators():
+            headers = dict(kwargs.pop('headers', None) or {})
+            if entry.etag is not None:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified is not None:
+                headers['If-Modified-Since'] = entry.last_modified
+            kwargs['headers'] = headers
+        response = session.request(method, url, **kwargs)
+
+        if entry is not None and response.status_code == 304:
+            entry.headers.update(response.headers)
+            entry.refresh(self.ttl(entry.headers))
+            self.set(key, entry)
+            self.__count(hits=1, revalidated=1, bytes_served=entry.size())
+            return entry.to_response()
+
+        self.__count(misses=1, bytes_fetched=len(response.content))
+        self.store(key, response)
+        return response
+
+    def store(self, key, response):
+        cache_control = self.cache_control(response.headers)
+        if 'no-store' in cache_control or response.status_code not in CACHEABLE_STATUS:
+            self.delete(key)
+            return
+        entry = CacheEntry(response, self.ttl(response.headers))
+        if (entry.is_fresh() or entry.has_validators()) and self.set(key, entry):
+            self.__count(stored=1)
+
+    @staticmethod
+    def cache_control(headers):
+        directives = {}
+        for item in headers.get('Cache-Control', '').split(','):
+            name, _, value = item.strip().partition('=')
+            if name:
+                directives[name.lower()] = value.strip('"')
+        return directives
+
+    def ttl(self, headers):
+        cache_control = self.cache_control(headers)
+        if 'no-cache' in cache_control:
+            return 0
+        for name in ('s-maxage', 'max-age'):
+            if name in cache_control:
+                try:
+                    return max(0, int(cache_control[name]) - int(headers.get('Age', 0)))
+                except ValueError:
+                    return 0
+        if 'Expires' in headers:
+            try:
+                return max(0, parsedate_to_datetime(headers['Expires']).timestamp() - time.time())
+            except (TypeError, ValueError):
+                return 0
+        return self.default_ttl
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self.memory.set(key, entry)
+        return entry
+
+    def set(self, key, entry):
+        stored = self.memory.set(key, entry)
+        if self.disk is not None:
+            self.disk.set(key, entry)
+            stored = True
+        return stored
+
+    def delete(self, key):
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def __count(self, **kwargs):
+        with self.__lock:
+            for name, value in kwargs.items():
+                self.stats[name] += value
@@ -1,7 +1,22 @@
+import os
+import random
 import inspect
+import hashlib
+import threading
 from functools import wraps
+from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from .http_cache import HttpCache
+except ImportError:
+    from http_cache import HttpCache
+
+CHUNK_SIZE = 64 * 1024
+RETRY_STATUS = (429, 500, 502, 503, 504)
 
 
 def check_status(func):
@@ -29,19 +44,145 @@ def for_all_methods(decorator):
     return decorate
 
 
+class JitterRetry(Retry):
+    """Retry with full jitter: sleep a random time up to the exponential backoff."""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff > 0 else 0
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter that tracks per-host in-flight requests against ``pool_maxsize``.
+
+    ``exhausted`` counts requests sent while every pooled connection of that
+    host was busy, i.e. ones that either waited (``pool_block=True``) or got a
+    throwaway connection that is discarded afterwards.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = {}
+        self.__lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).netloc
+        with self.__lock:
+            stats = self.stats.setdefault(host, {'requests': 0, 'in_flight': 0, 'peak': 0, 'exhausted': 0})
+            stats['requests'] += 1
+            stats['in_flight'] += 1
+            stats['peak'] = max(stats['peak'], stats['in_flight'])
+            if stats['in_flight'] > self._pool_maxsize:
+                stats['exhausted'] += 1
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            with self.__lock:
+                stats['in_flight'] -= 1
+
+
 @for_all_methods(check_status)
 class RequestsClient(object):
-    def __init__(self):
+    """Blocking HTTP client, safe to share across a thread pool.
+
+    Connections live in the mounted adapters' urllib3 pools, which are thread
+    safe, so one client serves many worker threads over keep-alive
+    connections. ``pool_maxsize`` should be at least the number of threads
+    hitting one host; ``host_pool_sizes`` overrides it per URL prefix, e.g.
+    ``{'https://api.example.com': 64}``. Failed requests (connection errors
+    and ``RETRY_STATUS`` responses) are retried ``max_retries`` times with
+    jittered exponential backoff.
+    """
+
+    def __init__(self, cache=None, pool_connections=10, pool_maxsize=10, pool_block=False, max_retries=0,
+                 backoff_factor=0.5, host_pool_sizes=None):
         self.session = requests.Session()
+        # opt-in: pass an HttpCache to serve repeated requests locally
+        self.cache = cache
+        retry = JitterRetry(total=max_retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUS,
+                            raise_on_status=False)
+        self.adapters = {}
+        for prefix, maxsize in [('https://', pool_maxsize), ('http://', pool_maxsize)] + \
+                sorted((host_pool_sizes or {}).items()):
+            self.adapters[prefix] = PooledAdapter(pool_connections=pool_connections, pool_maxsize=maxsize,
+                                                  pool_block=pool_block, max_retries=retry)
+            self.session.mount(prefix, self.adapters[prefix])
+
+    def pool_stats(self):
+        """Per-host request/in-flight/peak/exhausted counters across all adapters."""
+        stats = {}
+        for adapter in self.adapters.values():
+            for host, host_stats in adapter.stats.items():
+                total = stats.setdefault(host, dict.fromkeys(host_stats, 0))
+                for name, value in host_stats.items():
+                    total[name] = max(total[name], value) if name == 'peak' else total[name] + value
+        return stats
+
+    def request(self, method, url, **kwargs):
+        if self.cache is not None:
+            return self.cache.request(self.session, method, url, **kwargs)
+        return self.session.request(method, url, **kwargs)
 
     def response_json(self, *_, method, url, **kwargs):
-        return self.session.request(method, url, **kwargs).json()
+        return self.request(method, url, **kwargs).json()
 
     def response_content(self, *_, method, url, **kwargs):
-        return self.session.request(method, url, **kwargs).content
+        return self.request(method, url, **kwargs).content
 
     def response_text(self, *_, method, url, **kwargs):
-        return self.session.request(method, url, **kwargs).text
+        return self.request(method, url, **kwargs).text
+
+    def response_stream(self, *_, method, url, chunk_size=CHUNK_SIZE, **kwargs):
+        """Yield the body in ``chunk_size`` pieces; it is never held in memory as a whole."""
+        with self.session.request(method, url, stream=True, **kwargs) as response:
+            response.raise_for_status()
+            yield from response.iter_content(chunk_size)
+
+    @check_status
+    def download_to(self, path_or_writer, *_, method, url, chunk_size=CHUNK_SIZE, hash_name='sha256', **kwargs):
+        """Stream the body into a file path (str or os.PathLike) or any object with ``write()``.
+
+        The digest is computed incrementally while writing. Downloads to a path
+        go through ``<path>.part`` and resume from its size with an HTTP Range
+        request, so an interrupted transfer does not start over. Returns
+        ``(bytes_written, hexdigest)`` for the whole body.
+        """
+        digest = hashlib.new(hash_name)
+        if hasattr(path_or_writer, 'write'):
+            size = 0
+            for chunk in self.response_stream(method=method, url=url, chunk_size=chunk_size, **kwargs):
+                path_or_writer.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+            return size, digest.hexdigest()
+
+        path = os.fspath(path_or_writer)
+        part_path = path + '.part'
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = dict(kwargs.pop('headers', None) or {})
+        if offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+        with self.session.request(method, url, stream=True, headers=headers, **kwargs) as response:
+            if response.status_code == 416 and offset:
+                # the .part file already holds the whole body
+                mode, chunks = 'ab', []
+            else:
+                response.raise_for_status()
+                mode = 'ab' if response.status_code == 206 else 'wb'
+                chunks = response.iter_content(chunk_size)
+            size = 0
+            if mode == 'ab':
+                with open(part_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(chunk_size), b''):
+                        digest.update(chunk)
+                        size += len(chunk)
+            with open(part_path, mode) as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+        os.replace(part_path, path)
+        return size, digest.hexdigest()
 
 
 def main():
@@ -57,6 +198,22 @@ def main():
                                            params={'params': 'params'}, data={'form_data': 'form_data'}))
     print(requests_client.response_text(method='post', url='https://httpbin.org/post',
                                         params={'params': 'params'}, data={'form_data': 'form_data'}))
+    # cache
+    cached_client = RequestsClient(cache=HttpCache(default_ttl=60))
+    for _ in range(3):
+        cached_client.response_json(method='get', url='https://httpbin.org/get', params={'params': 'params'})
+    print(cached_client.cache.stats)
+    # stream
+    for chunk in requests_client.response_stream(method='get', url='https://httpbin.org/bytes/102400', chunk_size=8192):
+        print(len(chunk))
+    print(requests_client.download_to('bytes.bin', method='get', url='https://httpbin.org/range/102400'))
+    # pool
+    from concurrent.futures import ThreadPoolExecutor
+    pooled_client = RequestsClient(pool_maxsize=64, max_retries=3)
+    with ThreadPoolExecutor(max_workers=64) as executor:
+        list(executor.map(lambda i: pooled_client.response_json(method='get', url='https://httpbin.org/get',
+                                                                params={'a': i}), range(256)))
+    print(pooled_client.pool_stats())
 
 
 if __name__ == '__main__':